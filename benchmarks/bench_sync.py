@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline di wc-nocodb-sync.py
+
+Avvia i server finti WooCommerce e NocoDB (fake_servers.py), genera store
+sintetici di varie dimensioni ed esegue un full sync seguito da un sync
+incrementale con una piccola percentuale di ordini modificati.
+
+Per ogni scenario misura tempo totale, ordini/secondo, chiamate HTTP per ordine,
+byte trasferiti, 429 ricevuti e picco di memoria (RSS) del processo di sync,
+che gira in un processo separato per non contare la memoria dei server finti.
+
+Uso:
+    python3 benchmarks/bench_sync.py --sizes 1000,10000 --latency-ms 20 --p429 0.01
+    python3 benchmarks/bench_sync.py --output nuovo.json --compare vecchio.json
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fake_servers import FakeNocoDB, FakeServer, FakeWooCommerce
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPT = ROOT / 'wc-nocodb-sync.py'
+
+TABLE_IDS = {'clienti': 'mclienti', 'ordini': 'mordini'}
+UNLIMITED = {'requests_per_second': 1000, 'burst': 50, 'max_retries': 8}
+
+
+def load_sync_module():
+    """Importa wc-nocodb-sync.py (il nome col trattino non è importabile direttamente)"""
+    spec = importlib.util.spec_from_file_location('wc_nocodb_sync', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run_sync(config: Dict, full_sync: bool, conn):
+    """Eseguito nel processo figlio: un solo ciclo di sync, poi riporta le misure"""
+    module = load_sync_module()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    syncer = module.WCNocODBSyncer(config)
+    start = time.perf_counter()
+    ok = syncer.run_cycle(full_sync=full_sync)
+    wall_time = time.perf_counter() - start
+    syncer.state.close()
+
+    conn.send({
+        'ok': ok,
+        'wall_time': wall_time,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stats': dict(syncer.stats),
+    })
+    conn.close()
+
+
+def run_phase(config: Dict, full_sync: bool, servers: List[FakeServer], orders: int) -> Dict:
+    """Esegue un ciclo di sync in un processo pulito e raccoglie le metriche dei server"""
+    for server in servers:
+        server.backend.reset_counters()
+
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_sync, args=(config, full_sync, child_conn))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+
+    wc, noco = (server.backend for server in servers)
+    calls = wc.total_calls() + noco.total_calls()
+    result.update({
+        'orders': orders,
+        'orders_per_second': round(orders / result['wall_time'], 1) if result['wall_time'] else None,
+        'http_calls': calls,
+        'http_calls_per_order': round(calls / orders, 4) if orders else None,
+        'throttled_429': wc.throttled + noco.throttled,
+        'bytes_in': wc.bytes_out + noco.bytes_out,
+        'calls_by_endpoint': {**{f'wc {k}': v for k, v in wc.calls.items()},
+                              **{f'nocodb {k}': v for k, v in noco.calls.items()}},
+    })
+    result['wall_time'] = round(result['wall_time'], 3)
+    result['peak_rss_mb'] = round(result['peak_rss_mb'], 1)
+    return result
+
+
+def run_scenario(size: int, args) -> Dict:
+    """Full sync + incrementale su uno store sintetico di `size` ordini"""
+    wc = FakeWooCommerce(size, latency=args.latency_ms / 1000, p429=args.p429, seed=size)
+    noco = FakeNocoDB(latency=args.latency_ms / 1000, p429=args.p429, seed=size + 1)
+    servers = [FakeServer(wc).start(), FakeServer(noco).start()]
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='wc-nocodb-bench-') as state_dir:
+            config = {
+                'woocommerce': {
+                    'store_url': servers[0].url,
+                    'consumer_key': 'ck_bench',
+                    'consumer_secret': 'cs_bench',
+                    'rate_limit': UNLIMITED,
+                    'concurrency': args.concurrency,
+                    'customers': {'enrich': args.enrich_customers},
+                },
+                'nocodb': {
+                    'api_url': f'{servers[1].url}/api/v2',
+                    'api_token': 'bench',
+                    'batch_size': 100,
+                    'rate_limit': UNLIMITED,
+                    'table_ids': TABLE_IDS,
+                },
+                'state_dir': state_dir,
+            }
+
+            logging.info(f"📦 {size} ordini: full sync...")
+            full = run_phase(config, True, servers, size)
+
+            changed = list(range(1, size + 1, max(1, int(1 / args.changed_ratio))))
+            wc.touch(changed, status='processing')
+            logging.info(f"📦 {size} ordini: incrementale ({len(changed)} modificati)...")
+            incremental = run_phase(config, False, servers, len(changed))
+    finally:
+        for server in servers:
+            server.stop()
+
+    return {'size': size, 'full_sync': full, 'incremental': incremental}
+
+
+def compare(current: Dict, previous: Dict):
+    """Stampa le differenze percentuali rispetto a un risultato precedente"""
+    old = {r['size']: r for r in previous.get('results', [])}
+    for result in current['results']:
+        base = old.get(result['size'])
+        if not base:
+            continue
+        for phase in ('full_sync', 'incremental'):
+            for metric in ('wall_time', 'orders_per_second', 'http_calls_per_order', 'peak_rss_mb'):
+                before, after = base[phase].get(metric), result[phase].get(metric)
+                if before and after is not None:
+                    delta = (after - before) / before * 100
+                    print(f"{result['size']:>7} {phase:<12} {metric:<22} {before:>10} → {after:<10} ({delta:+.1f}%)")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline WooCommerce → NocoDB sync')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Numero di ordini per scenario')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latenza simulata per richiesta')
+    parser.add_argument('--p429', type=float, default=0, help='Probabilità di risposta 429 per richiesta')
+    parser.add_argument('--concurrency', type=int, default=4, help='Pagine WooCommerce in parallelo')
+    parser.add_argument('--changed-ratio', type=float, default=0.01,
+                        help='Frazione di ordini modificati prima del sync incrementale')
+    parser.add_argument('--enrich-customers', action='store_true',
+                        help='Arricchisce i clienti con /customers?include= (woocommerce.customers.enrich)')
+    parser.add_argument('--output', default='bench_results.json', help='File JSON dei risultati')
+    parser.add_argument('--compare', help='JSON di un benchmark precedente da confrontare')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'results': [run_scenario(int(size), args) for size in args.sizes.split(',')],
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"✅ Risultati salvati in {args.output}")
+
+    for result in report['results']:
+        for phase in ('full_sync', 'incremental'):
+            r = result[phase]
+            print(f"{result['size']:>7} {phase:<12} {r['wall_time']:>8.2f}s {r['orders_per_second']:>9} ord/s "
+                  f"{r['http_calls_per_order']:>7} call/ord {r['peak_rss_mb']:>7} MB  429={r['throttled_429']}"
+                  f"{'' if r['ok'] else '  ❌'}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
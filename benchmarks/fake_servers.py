@@ -0,0 +1,359 @@
+"""
+Server finti WooCommerce e NocoDB per benchmark offline.
+
+Implementano solo quello che usa wc-nocodb-sync.py:
+- WooCommerce: GET /wp-json/wc/v3/orders con status, modified_after, after/before,
+  include, orderby/order, paginazione (X-WP-Total / X-WP-TotalPages) e _fields;
+  GET /wp-json/wc/v3/customers con include
+- NocoDB: GET/POST/PATCH/DELETE /api/v2/tables/{id}/records con where (eq, ~or),
+  fields, limit/offset, pageInfo e payload array
+
+Entrambi supportano latenza configurabile e risposte 429 iniettate.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+BASE_DATE = datetime(2020, 1, 1)
+
+# Distribuzione stati tipica di uno store maturo: quasi tutto completato
+STATUS_CYCLE = (['completed'] * 14 + ['processing'] * 2 + ['pending', 'on-hold', 'cancelled', 'refunded'])
+
+
+class FakeBackend:
+    """Base comune: contatori, latenza e 429 iniettati"""
+
+    def __init__(self, latency: float = 0.0, p429: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.p429 = p429
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.bytes_out = 0
+        self.throttled = 0
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_out = 0
+            self.throttled = 0
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Any) -> Tuple[int, Any, Dict]:
+        raise NotImplementedError
+
+
+class FakeWooCommerce(FakeBackend):
+    """Store WooCommerce sintetico con ordini generati in modo deterministico"""
+
+    def __init__(self, n_orders: int, n_customers: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.n_orders = n_orders
+        self.n_customers = n_customers or max(1, n_orders // 3)
+        self.status = [STATUS_CYCLE[i % len(STATUS_CYCLE)] for i in range(n_orders)]
+        self.modified = [self._created(i + 1) + timedelta(hours=1) for i in range(n_orders)]
+        self._query_cache: Dict[tuple, List[int]] = {}
+
+    @staticmethod
+    def _created(order_id: int) -> datetime:
+        return BASE_DATE + timedelta(minutes=5 * order_id)
+
+    def touch(self, order_ids: List[int], status: Optional[str] = None):
+        """Simula modifiche in WooCommerce (nuovo date_modified ed eventualmente stato)"""
+        now = datetime.utcnow().replace(microsecond=0)
+        with self.lock:
+            for order_id in order_ids:
+                self.modified[order_id - 1] = now
+                if status:
+                    self.status[order_id - 1] = status
+            self._query_cache.clear()
+
+    def order(self, order_id: int) -> Dict:
+        """Rappresentazione completa di un ordine (con i campi pesanti che il sync non usa)"""
+        i = order_id - 1
+        customer = order_id % self.n_customers
+        created = self._created(order_id).isoformat()
+        modified = self.modified[i].isoformat()
+        total = f"{20 + (order_id % 50) * 5:.2f}"
+        address = {
+            'first_name': f'Nome{customer}', 'last_name': f'Cognome{customer}', 'company': '',
+            'address_1': f'Via Roma {customer}', 'address_2': '', 'city': 'Milano', 'state': 'MI',
+            'postcode': '20100', 'country': 'IT',
+        }
+        refunds = [{'id': order_id * 10, 'reason': '', 'total': f"-{total}"}] if self.status[i] == 'refunded' else []
+        return {
+            'id': order_id, 'parent_id': 0, 'status': self.status[i], 'currency': 'EUR', 'version': '8.0.0',
+            'prices_include_tax': True, 'date_created': created, 'date_modified': modified,
+            'date_created_gmt': created, 'date_modified_gmt': modified,
+            'discount_total': '0.00', 'discount_tax': '0.00', 'shipping_total': '0.00', 'shipping_tax': '0.00',
+            'cart_tax': '0.00', 'total': total, 'total_tax': '0.00', 'customer_id': customer,
+            'order_key': f'wc_order_{order_id:012d}',
+            'billing': {**address, 'email': f'cliente{customer}@example.com', 'phone': f'+39 333 {customer:07d}'},
+            'shipping': {**address, 'phone': ''},
+            'payment_method': 'stripe', 'payment_method_title': 'Carta di credito',
+            'transaction_id': f'ch_{order_id:020d}', 'customer_ip_address': '127.0.0.1',
+            'customer_user_agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)',
+            'created_via': 'checkout', 'customer_note': '', 'date_completed': modified, 'date_paid': created,
+            'cart_hash': f'{order_id:032x}',
+            'meta_data': [
+                {'id': order_id * 3, 'key': 'percorso', 'value': f'Percorso {order_id % 7}'},
+                {'id': order_id * 3 + 1, 'key': '_data_partenza', 'value': '2025-06-01'},
+                {'id': order_id * 3 + 2, 'key': '_stripe_fee', 'value': '0.54'},
+            ],
+            'line_items': [{
+                'id': order_id * 100 + n, 'name': f'Evento {order_id % 13 + n}', 'product_id': 100 + n,
+                'variation_id': 0, 'quantity': 1 + n, 'tax_class': '', 'subtotal': total, 'subtotal_tax': '0.00',
+                'total': total, 'total_tax': '0.00', 'taxes': [], 'sku': f'EV-{n}', 'price': float(total),
+                'meta_data': [{'id': 1, 'key': '_reduced_stock', 'value': '1'}],
+            } for n in range(1 + order_id % 2)],
+            'tax_lines': [], 'shipping_lines': [], 'fee_lines': [], 'coupon_lines': [], 'refunds': refunds,
+            '_links': {
+                'self': [{'href': f'https://example.com/wp-json/wc/v3/orders/{order_id}'}],
+                'collection': [{'href': 'https://example.com/wp-json/wc/v3/orders'}],
+            },
+        }
+
+    def _matching_ids(self, query: Dict[str, str]) -> List[int]:
+        key = tuple(sorted((k, v) for k, v in query.items() if k not in ('page', 'per_page', '_fields')))
+        with self.lock:
+            cached = self._query_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Come WooCommerce: senza status (o con `any`) tutti gli stati tranne trash
+        statuses = set(query['status'].split(',')) if query.get('status') and query['status'] != 'any' else None
+        modified_after = datetime.fromisoformat(query['modified_after']) if query.get('modified_after') else None
+        after = datetime.fromisoformat(query['after']) if query.get('after') else None
+        before = datetime.fromisoformat(query['before']) if query.get('before') else None
+        include = {int(x) for x in query['include'].split(',') if x} if query.get('include') else None
+
+        ids = []
+        for i in range(self.n_orders):
+            order_id = i + 1
+            if statuses is not None and self.status[i] not in statuses:
+                continue
+            if statuses is None and self.status[i] == 'trash':
+                continue
+            if modified_after is not None and self.modified[i] <= modified_after:
+                continue
+            if after is not None and self._created(order_id) <= after:
+                continue
+            if before is not None and self._created(order_id) >= before:
+                continue
+            if include is not None and order_id not in include:
+                continue
+            ids.append(order_id)
+
+        if query.get('orderby') == 'modified':
+            ids.sort(key=lambda order_id: (self.modified[order_id - 1], order_id))
+        if query.get('order', 'desc') == 'desc':
+            ids.reverse()
+
+        with self.lock:
+            self._query_cache[key] = ids
+        return ids
+
+    def customer(self, customer_id: int) -> Dict:
+        return {
+            'id': customer_id, 'email': f'cliente{customer_id}@example.com', 'username': f'cliente{customer_id}',
+            'first_name': f'Nome{customer_id}', 'last_name': f'Cognome{customer_id}', 'role': 'customer',
+            'date_created_gmt': (BASE_DATE + timedelta(days=customer_id % 365)).isoformat(),
+            'is_paying_customer': True, 'avatar_url': 'https://secure.gravatar.com/avatar/?s=96&d=mm&r=g',
+            'meta_data': [],
+        }
+
+    def handle_customers(self, query):
+        # id 0 = ospite: non esiste come cliente registrato
+        include = [int(x) for x in query.get('include', '').split(',') if x]
+        ids = [i for i in include if 0 < i < self.n_customers] if include else list(range(1, self.n_customers))
+        per_page = int(query.get('per_page', 10))
+        page = int(query.get('page', 1))
+        customers = [self.customer(i) for i in ids[(page - 1) * per_page:page * per_page]]
+        if query.get('_fields'):
+            customers = [project_fields(customer, query['_fields'].split(',')) for customer in customers]
+        total_pages = max(1, -(-len(ids) // per_page))
+        return 200, customers, {'X-WP-Total': str(len(ids)), 'X-WP-TotalPages': str(total_pages)}
+
+    def handle(self, method, path, query, body):
+        if method == 'GET' and path == '/wp-json/wc/v3/customers':
+            return self.handle_customers(query)
+        if method != 'GET' or not path.startswith('/wp-json/wc/v3/orders'):
+            return 404, {'code': 'rest_no_route'}, {}
+
+        ids = self._matching_ids(query)
+        per_page = int(query.get('per_page', 10))
+        page = int(query.get('page', 1))
+        orders = [self.order(order_id) for order_id in ids[(page - 1) * per_page:page * per_page]]
+
+        if query.get('_fields'):
+            orders = [project_fields(order, query['_fields'].split(',')) for order in orders]
+
+        total_pages = max(1, -(-len(ids) // per_page))
+        return 200, orders, {'X-WP-Total': str(len(ids)), 'X-WP-TotalPages': str(total_pages)}
+
+
+def project_fields(data: Dict, fields: List[str]) -> Dict:
+    """Applica _fields come WordPress (sotto-campi di oggetti con notazione a punti)"""
+    result = {}
+    for field in fields:
+        top, _, sub = field.partition('.')
+        if top not in data:
+            continue
+        if sub and isinstance(data[top], dict):
+            result.setdefault(top, {})[sub] = data[top].get(sub)
+        else:
+            result[top] = data[top]
+    return result
+
+
+class FakeNocoDB(FakeBackend):
+    """Tabelle NocoDB in memoria"""
+
+    PATH = re.compile(r'^/api/v2/tables/([^/]+)/records(?:/(\d+))?$')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tables: Dict[str, Dict[int, Dict]] = {}
+        self.next_id = 1
+
+    @staticmethod
+    def _matches(record: Dict, where: Optional[str]) -> bool:
+        if not where:
+            return True
+        for clause in where.split('~or'):
+            match = re.match(r'^\((.+?),(eq|like),(.*)\)$', clause.strip())
+            if not match:
+                continue
+            value = str(record.get(match.group(1)))
+            if match.group(2) == 'eq' and value == match.group(3):
+                return True
+            if match.group(2) == 'like' and match.group(3).strip('%') in value:
+                return True
+        return False
+
+    def handle(self, method, path, query, body):
+        match = self.PATH.match(path)
+        if not match:
+            return 404, {'msg': 'not found'}, {}
+
+        table_id, record_id = match.group(1), match.group(2)
+        with self.lock:
+            table = self.tables.setdefault(table_id, {})
+
+            if method == 'GET':
+                records = [r for r in table.values() if self._matches(r, query.get('where'))]
+                limit = int(query.get('limit', 25))
+                offset = int(query.get('offset', 0))
+                page = records[offset:offset + limit]
+                if query.get('fields'):
+                    columns = query['fields'].split(',')
+                    page = [{c: r.get(c) for c in columns} for r in page]
+                return 200, {
+                    'list': page,
+                    'pageInfo': {'totalRows': len(records), 'isLastPage': offset + limit >= len(records)},
+                }, {}
+
+            rows = body if isinstance(body, list) else [body]
+            result = []
+
+            if method == 'POST':
+                for row in rows:
+                    new_id = self.next_id
+                    self.next_id += 1
+                    table[new_id] = {**row, 'Id': new_id}
+                    result.append({'Id': new_id})
+            elif method == 'PATCH':
+                targets = [int(record_id)] if record_id else [int(row['Id']) for row in rows]
+                if any(target not in table for target in targets):
+                    return 404, {'msg': 'Record not found'}, {}
+                for target, row in zip(targets, rows):
+                    table[target].update({k: v for k, v in row.items() if k != 'Id'})
+                    result.append({'Id': target})
+            elif method == 'DELETE':
+                for row in rows:
+                    table.pop(int(row['Id']), None)
+                    result.append({'Id': row['Id']})
+            else:
+                return 405, {'msg': 'method not allowed'}, {}
+
+        return 200, result if isinstance(body, list) else result[0], {}
+
+
+class FakeServer:
+    """Espone un FakeBackend via HTTP su una porta locale libera"""
+
+    def __init__(self, backend: FakeBackend, host: str = '127.0.0.1'):
+        self.backend = backend
+        self.httpd = ThreadingHTTPServer((host, 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _make_handler(self):
+        backend = self.backend
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+
+                with backend.lock:
+                    backend.calls[f'{self.command} {re.sub(r"/[0-9a-z]{1,}/records", "/{id}/records", url.path)}'] += 1
+
+                if backend.latency:
+                    time.sleep(backend.latency)
+
+                with backend.lock:
+                    throttle = backend.p429 and backend.random.random() < backend.p429
+                if throttle:
+                    with backend.lock:
+                        backend.throttled += 1
+                    return self._send(429, {'message': 'Too Many Requests'}, {'Retry-After': '0.1'})
+
+                status, payload, headers = backend.handle(self.command, url.path, query, body)
+                self._send(status, payload, headers)
+
+            def _send(self, status: int, payload: Any, headers: Dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with backend.lock:
+                    backend.bytes_out += len(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -4,15 +4,41 @@ WooCommerce → NocoDB Sync Script
 Sincronizza ordini e clienti da WooCommerce a NocoDB con deduplicazione intelligente.
 """
 
+import atexit
+import base64
+import cProfile
+import gzip
+import hashlib
+import hmac
+import itertools
 import json
 import logging
 import os
+import pstats
+import queue
+import random
+import re
+import signal
+import sqlite3
+import multiprocessing
 import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Any
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional, Dict, List, Any, Iterator, Iterable, Callable, Tuple
 from pathlib import Path
+from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import NewConnectionError
 import time
 
 # ============================================================================
@@ -20,458 +46,3811 @@ import time
 # ============================================================================
 
 LOG_FILE = "/tmp/wc-nocodb-sync.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Default della sezione "logging"
+DEFAULT_LOGGING_CONFIG = {
+    'file': LOG_FILE,           # None = solo stdout
+    'max_bytes': 10 * 1024 * 1024,
+    'backup_count': 5,
+    'format': 'text',           # 'text' o 'json' (una riga JSON per messaggio)
+    'stdout': True,
+    'sample_first': 5,          # messaggi per-record scritti a INFO per tipo...
+    'sample_every': 100,        # ...poi uno ogni N (gli altri a DEBUG)
+}
+
 logger = logging.getLogger(__name__)
 
 
+class JsonLinesFormatter(logging.Formatter):
+    """Una riga JSON per messaggio (per Loki, Elasticsearch, jq...)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogSampler:
+    """
+    Campionamento dei messaggi per-record (pagine scaricate, cambi di stato...).
+
+    Per ogni tipo di messaggio i primi `first` vanno a INFO, poi uno ogni `every`;
+    gli altri scendono a DEBUG. `flush` riporta a INFO quanti ne sono stati nascosti.
+    """
+
+    def __init__(self, first: int = 5, every: int = 100):
+        self.first = first
+        self.every = max(1, every)
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def log(self, kind: str, message: str):
+        with self.lock:
+            count = self.counts[kind] = self.counts.get(kind, 0) + 1
+        level = logging.INFO if count <= self.first or count % self.every == 0 else logging.DEBUG
+        logger.log(level, message)
+
+    def flush(self):
+        """Riepilogo dei messaggi campionati dall'ultimo flush"""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        for kind, count in sorted(counts.items()):
+            hidden = count - min(count, self.first) - (count // self.every - min(count, self.first) // self.every)
+            if hidden > 0:
+                logger.info(f"🔇 {kind}: {count} messaggi, {hidden} solo a livello DEBUG")
+
+
+_log_sampler = LogSampler()
+_log_listener: Optional[QueueListener] = None
+
+
+def setup_logging(log_config: Optional[Dict] = None, level: int = logging.INFO):
+    """
+    Configura il logging (sezione "logging" della configurazione).
+
+    I thread del sync si limitano ad accodare i messaggi (QueueHandler); un thread
+    dedicato (QueueListener) li scrive su stdout e sul file con rotazione, così
+    l'I/O dei log non rallenta download, trasformazione e scritture.
+    Si può richiamare per riconfigurare: il listener precedente viene svuotato e fermato.
+    """
+    global _log_listener
+    log_config = {**DEFAULT_LOGGING_CONFIG, **(log_config or {})}
+
+    formatter = JsonLinesFormatter() if log_config['format'] == 'json' else logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if log_config['file']:
+        handlers.append(RotatingFileHandler(
+            os.path.expanduser(log_config['file']),
+            maxBytes=int(log_config['max_bytes']),
+            backupCount=int(log_config['backup_count']),
+            encoding='utf-8'
+        ))
+    if log_config['stdout']:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    root = logging.getLogger()
+    previous = root.handlers[:]
+    root.addHandler(QueueHandler(log_queue))
+    for handler in previous:
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    stop_logging()
+    _log_listener = listener
+    _log_sampler.first = int(log_config['sample_first'])
+    _log_sampler.every = max(1, int(log_config['sample_every']))
+
+
+def stop_logging():
+    """Scrive i messaggi ancora in coda e chiude i file di log"""
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
+
+
+atexit.register(stop_logging)
+
+
+def _init_worker_logging(log_queue, level: int):
+    """Nei processi worker: i messaggi vanno al processo principale, che li scrive"""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+class _ForwardToLogger(logging.Handler):
+    """Reinoltra i record arrivati dai worker ai logger del processo principale"""
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        logging.getLogger(record.name).handle(record)
+        return True
+
+
+# ============================================================================
+# RATE LIMITING
+# ============================================================================
+
+# Status per cui ha senso ritentare (rate limit o server temporaneamente in difficoltà)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Metodi ritentabili anche su 5xx/errori di rete (i nostri PATCH inviano sempre il payload completo)
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'}
+
+
+class RateLimiter:
+    """
+    Token bucket adattivo, condiviso da tutti i client che parlano con lo stesso host.
+
+    Parte da `requests_per_second` (che è anche il tetto massimo), dimezza il rate
+    quando il server risponde 429/5xx e lo riporta gradualmente al massimo finché
+    le risposte sono sane (AIMD). Rispetta `Retry-After` e `X-RateLimit-*`.
+
+    I token vengono assegnati in ordine di arrivo: con più negozi nello stesso
+    processo nessuno monopolizza il budget dell'host. `max_concurrency` limita
+    inoltre le richieste in volo verso l'host (None = nessun limite).
+    """
+
+    def __init__(self, requests_per_second: float = 1.0, burst: int = 1,
+                 min_rate: Optional[float] = None, recovery_step: float = 0.1,
+                 max_concurrency: Optional[int] = None):
+        self.max_rate = float(requests_per_second)
+        self.rate = self.max_rate
+        self.min_rate = min(min_rate, self.max_rate) if min_rate else self.max_rate / 8
+        self.recovery_step = recovery_step  # frazione di max_rate recuperata per risposta sana
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        self.turn = threading.Condition(self.lock)  # notificata quando la testa della coda cambia
+        self.waiting = deque()  # richieste in attesa di un token, in ordine di arrivo
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """
+        Attende finché è disponibile un token (prima le richieste arrivate prima).
+
+        Returns:
+            Secondi trascorsi in attesa
+        """
+        start = time.monotonic()
+        ticket = object()
+        with self.lock:
+            self.waiting.append(ticket)
+
+        try:
+            with self.turn:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self.blocked_until - now
+
+                    if wait <= 0:
+                        position = self.waiting.index(ticket)
+                        if position == 0 and self.tokens >= 1:
+                            self.tokens -= 1
+                            self.waiting.popleft()
+                            ticket = None
+                            self.turn.notify_all()
+                            return time.monotonic() - start
+                        # Dietro ad altri i token possono già bastare (attesa negativa): si
+                        # aspetta la notifica del proprio turno, al più per un intervallo di token
+                        wait = max((position + 1 - self.tokens) / self.rate, 1.0 / self.rate)
+
+                    self.turn.wait(wait)
+        finally:
+            # Interrotta (es. KeyboardInterrupt): libera il posto in coda
+            if ticket is not None:
+                with self.turn:
+                    self.waiting.remove(ticket)
+                    self.turn.notify_all()
+
+    def slot(self):
+        """Context manager che occupa uno dei `max_concurrency` posti dell'host durante la richiesta"""
+        return self.slots if self.slots is not None else nullcontext()
+
+    def block_for(self, seconds: float):
+        """Sospende tutte le richieste verso l'host per `seconds` secondi"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def on_success(self, response: requests.Response):
+        """Risposta sana: accelera verso il rate massimo e rispetta X-RateLimit-*"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery_step)
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.strip() == '0':
+            reset = _parse_rate_limit_reset(response.headers.get('X-RateLimit-Reset'))
+            if reset:
+                logger.debug(f"⏱️ Quota esaurita su {urlparse(response.url).netloc}, pausa {reset:.1f}s")
+                self.block_for(reset)
+
+    def on_throttle(self, delay: float):
+        """Risposta 429/5xx: dimezza il rate e blocca l'host per `delay` secondi"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+        self.block_for(delay)
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(url: str, rate_limit: Optional[Dict] = None) -> RateLimiter:
+    """
+    Restituisce il RateLimiter condiviso per l'host di `url` (creandolo se serve).
+
+    Args:
+        url: URL qualsiasi dell'host
+        rate_limit: {'requests_per_second': float, 'burst': int, 'max_concurrency': int}
+            (usato solo alla creazione: con più negozi vale il primo che usa l'host)
+    """
+    host = urlparse(url).netloc
+    rate_limit = rate_limit or {}
+
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = RateLimiter(
+                requests_per_second=rate_limit.get('requests_per_second', 1.0),
+                burst=rate_limit.get('burst', 1),
+                max_concurrency=rate_limit.get('max_concurrency')
+            )
+        return _rate_limiters[host]
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Interpreta l'header Retry-After (secondi o data HTTP)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+
+
+def _parse_rate_limit_reset(value: Optional[str]) -> Optional[float]:
+    """Interpreta X-RateLimit-Reset (secondi mancanti o timestamp epoch)"""
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    # Valori "grandi" sono timestamp epoch, quelli piccoli secondi mancanti
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+def request_with_backoff(session: requests.Session, limiter: RateLimiter, method: str, url: str,
+                         max_retries: int = 5, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                         **kwargs) -> requests.Response:
+    """
+    Esegue una richiesta HTTP rispettando il rate limiter dell'host.
+
+    Su 429 (sempre) e su 5xx/errori di rete (solo metodi idempotenti) ritenta con
+    backoff esponenziale + jitter, fino a `max_retries` tentativi. Se il server
+    indica `Retry-After`, quello ha la precedenza sul backoff calcolato. È l'unico
+    livello di retry: la Session non ritenta nulla a livello di trasporto.
+    Le connessioni mai stabilite si ritentano per qualsiasi metodo (la richiesta
+    non è partita, quindi non può essere stata applicata).
+
+    Returns:
+        L'ultima risposta ricevuta (il chiamante decide se fare raise_for_status)
+    """
+    method = method.upper()
+    attempt = 0
+
+    while True:
+        _http_metrics.record_wait(url, limiter.acquire())
+
+        started = time.perf_counter()
+        try:
+            with limiter.slot():
+                response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            _http_metrics.observe(method, url, None, time.perf_counter() - started)
+            if (method not in IDEMPOTENT_METHODS and not _request_not_sent(e)) or attempt >= max_retries:
+                raise
+            delay = _backoff_delay(attempt, backoff_base, backoff_max)
+            logger.warning(f"🔌 Errore di rete su {method} {urlparse(url).path}: {e}, riprovo tra {delay:.1f}s...")
+            limiter.on_throttle(delay)
+            _http_metrics.record_retry(method, url, 'network')
+            attempt += 1
+            continue
+
+        _http_metrics.observe(method, url, response, time.perf_counter() - started)
+
+        retryable = response.status_code == 429 or (
+            response.status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS
+        )
+        if not retryable or attempt >= max_retries:
+            if response.status_code < 400:
+                limiter.on_success(response)
+            return response
+
+        delay = _parse_retry_after(response.headers.get('Retry-After'))
+        if delay is None:
+            delay = _backoff_delay(attempt, backoff_base, backoff_max)
+        logger.warning(f"⏱️ HTTP {response.status_code} da {urlparse(url).netloc}, "
+                       f"attendo {delay:.1f}s (tentativo {attempt + 1}/{max_retries})...")
+        limiter.on_throttle(delay)
+        _http_metrics.record_retry(method, url, str(response.status_code))
+        attempt += 1
+
+
+# Caratteri che non si possono usare nei valori di un filtro `where` NocoDB
+WHERE_UNSAFE = re.compile(r'[,()~]')
+
+
+def check_bulk_response(rows: List[Dict], records: Any):
+    """Solleva ValueError se NocoDB non ha restituito un record per ogni riga inviata"""
+    if not isinstance(records, list) or len(records) != len(rows):
+        count = len(records) if isinstance(records, list) else 0
+        raise ValueError(f"NocoDB ha restituito {count} record per {len(rows)} righe inviate")
+
+
+def _request_not_sent(error: BaseException) -> bool:
+    """True se la connessione non è mai stata stabilita (timeout di connessione o connessione rifiutata)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def is_rejected_request(error: BaseException) -> bool:
+    """
+    True se il server ha rifiutato la richiesta (4xx), quindi di sicuro non l'ha applicata.
+
+    Timeout, errori di rete, 5xx e 429 esauriti hanno esito incerto: la scrittura
+    potrebbe essere già avvenuta.
+    """
+    response = getattr(error, 'response', None)
+    return (isinstance(error, requests.exceptions.HTTPError) and response is not None
+            and 400 <= response.status_code < 500 and response.status_code not in (408, 429))
+
+
+def _backoff_delay(attempt: int, base: float, maximum: float) -> float:
+    """Backoff esponenziale con jitter (metà fissa + metà casuale)"""
+    delay = min(maximum, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# ============================================================================
+# METRICHE HTTP
+# ============================================================================
+
+# Limiti superiori (secondi) dell'istogramma delle latenze
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_JSON_FILE = 'metrics.json'
+METRICS_PROM_FILE = 'metrics.prom'
+
+
+def endpoint_label(url: str) -> str:
+    """Path dell'URL con gli id sostituiti da {id}, per raggruppare le chiamate"""
+    path = re.sub(r'/tables/[^/]+', '/tables/{id}', urlparse(url).path)
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+
+class HttpMetrics:
+    """
+    Metriche delle chiamate HTTP di un ciclo di sync, raggruppate per host/metodo/endpoint.
+
+    Alimentata da request_with_backoff: conteggi per status, istogramma delle
+    latenze, byte inviati/ricevuti, retry (per motivo) e secondi passati in
+    attesa del rate limiter (per host). Thread-safe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints: Dict[tuple, Dict] = {}
+            self.waits: Dict[str, float] = {}
+
+    def _entry(self, method: str, url: str) -> Dict:
+        return self._entry_for((urlparse(url).netloc, method, endpoint_label(url)))
+
+    def _entry_for(self, key: tuple) -> Dict:
+        if key not in self.endpoints:
+            self.endpoints[key] = {
+                'statuses': {}, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'latency_sum': 0.0,
+                'bytes_decoded': 0, 'bytes_out': 0, 'retries': {},
+            }
+        return self.endpoints[key]
+
+    def observe(self, method: str, url: str, response: Optional[requests.Response], seconds: float):
+        """Registra una risposta (None = errore di rete/timeout)"""
+        status = str(response.status_code) if response is not None else 'error'
+        # Corpo già decompresso: con gzip non coincide con il traffico di rete, che con
+        # risposte chunked non è misurabile da requests
+        bytes_decoded = len(response.content) if response is not None else 0
+        body = response.request.body if response is not None else None
+        bytes_out = len(body.encode() if isinstance(body, str) else body or b'')
+
+        with self.lock:
+            entry = self._entry(method, url)
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+            entry['buckets'][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            entry['latency_sum'] += seconds
+            entry['bytes_decoded'] += bytes_decoded
+            entry['bytes_out'] += bytes_out
+
+    def record_retry(self, method: str, url: str, reason: str):
+        with self.lock:
+            retries = self._entry(method, url)['retries']
+            retries[reason] = retries.get(reason, 0) + 1
+
+    def record_wait(self, url: str, seconds: float):
+        """Tempo passato in attesa del rate limiter (incluse le pause dopo 429/backoff)"""
+        if seconds <= 0:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            self.waits[host] = self.waits.get(host, 0.0) + seconds
+
+    def snapshot(self) -> Dict:
+        """Copia dei contatori grezzi, da fondere con merge() (es. dai processi worker)"""
+        with self.lock:
+            return {
+                'endpoints': {
+                    key: {**entry, 'statuses': dict(entry['statuses']), 'buckets': list(entry['buckets']),
+                          'retries': dict(entry['retries'])}
+                    for key, entry in self.endpoints.items()
+                },
+                'waits': dict(self.waits),
+            }
+
+    def merge(self, snapshot: Dict):
+        """Somma ai contatori quelli di uno snapshot()"""
+        with self.lock:
+            for key, other in snapshot['endpoints'].items():
+                entry = self._entry_for(key)
+                for field in ('statuses', 'retries'):
+                    for name, count in other[field].items():
+                        entry[field][name] = entry[field].get(name, 0) + count
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], other['buckets'])]
+                for field in ('latency_sum', 'bytes_decoded', 'bytes_out'):
+                    entry[field] += other[field]
+            for host, seconds in snapshot['waits'].items():
+                self.waits[host] = self.waits.get(host, 0.0) + seconds
+
+    def summary(self) -> Dict:
+        """Riepilogo serializzabile in JSON, con totali per host"""
+        with self.lock:
+            endpoints = []
+            hosts: Dict[str, Dict] = {}
+
+            for (host, method, endpoint), entry in sorted(self.endpoints.items()):
+                count = sum(entry['statuses'].values())
+                endpoints.append({
+                    'host': host, 'method': method, 'endpoint': endpoint, 'requests': count,
+                    'statuses': dict(entry['statuses']), 'retries': dict(entry['retries']),
+                    'latency_avg': round(entry['latency_sum'] / count, 4) if count else 0.0,
+                    'latency_sum': round(entry['latency_sum'], 3),
+                    'latency_buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], entry['buckets'])),
+                    'bytes_decoded': entry['bytes_decoded'], 'bytes_out': entry['bytes_out'],
+                })
+                totals = hosts.setdefault(host, {'requests': 0, 'latency_sum': 0.0, 'throttled': 0,
+                                                 'retries': 0, 'bytes_decoded': 0, 'bytes_out': 0})
+                totals['requests'] += count
+                totals['latency_sum'] += entry['latency_sum']
+                totals['throttled'] += entry['statuses'].get('429', 0)
+                totals['retries'] += sum(entry['retries'].values())
+                totals['bytes_decoded'] += entry['bytes_decoded']
+                totals['bytes_out'] += entry['bytes_out']
+
+            for host in set(hosts) | set(self.waits):
+                totals = hosts.setdefault(host, {'requests': 0, 'latency_sum': 0.0, 'throttled': 0,
+                                                 'retries': 0, 'bytes_decoded': 0, 'bytes_out': 0})
+                totals['latency_sum'] = round(totals['latency_sum'], 3)
+                totals['rate_limit_wait'] = round(self.waits.get(host, 0.0), 3)
+
+            return {'hosts': hosts, 'endpoints': endpoints}
+
+    def to_prometheus(self, gauges: Dict[str, tuple] = None) -> str:
+        """
+        Formato testo Prometheus (per il textfile collector di node_exporter).
+
+        Args:
+            gauges: metriche aggiuntive {nome: (valore, descrizione)}; il valore può
+                essere un dict {negozio: valore} (una serie per negozio, label `store`)
+        """
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f'# HELP wc_nocodb_{name} {help_text}')
+            lines.append(f'# TYPE wc_nocodb_{name} {kind}')
+
+        def labels(**values) -> str:
+            return '{' + ','.join(f'{k}="{v}"' for k, v in values.items()) + '}'
+
+        with self.lock:
+            items = sorted(self.endpoints.items())
+            waits = dict(self.waits)
+
+        metric('http_requests_total', 'counter', 'Richieste HTTP per endpoint e status')
+        for (host, method, endpoint), entry in items:
+            for status, count in sorted(entry['statuses'].items()):
+                lines.append(f'wc_nocodb_http_requests_total'
+                             f'{labels(host=host, method=method, endpoint=endpoint, status=status)} {count}')
+
+        metric('http_request_duration_seconds', 'histogram', 'Latenza delle richieste HTTP')
+        for (host, method, endpoint), entry in items:
+            base = dict(host=host, method=method, endpoint=endpoint)
+            cumulative = 0
+            for bound, count in zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], entry['buckets']):
+                cumulative += count
+                lines.append(f'wc_nocodb_http_request_duration_seconds_bucket{labels(**base, le=bound)} {cumulative}')
+            lines.append(f'wc_nocodb_http_request_duration_seconds_sum{labels(**base)} {entry["latency_sum"]:.6f}')
+            lines.append(f'wc_nocodb_http_request_duration_seconds_count{labels(**base)} {cumulative}')
+
+        for name, field, help_text in (('http_response_decoded_bytes_total', 'bytes_decoded',
+                                        'Byte ricevuti (corpo decompresso, non il traffico di rete)'),
+                                       ('http_request_bytes_total', 'bytes_out', 'Byte inviati')):
+            metric(name, 'counter', help_text)
+            for (host, method, endpoint), entry in items:
+                lines.append(f'wc_nocodb_{name}{labels(host=host, method=method, endpoint=endpoint)} {entry[field]}')
+
+        metric('http_retries_total', 'counter', 'Retry per motivo (status HTTP o network)')
+        for (host, method, endpoint), entry in items:
+            for reason, count in sorted(entry['retries'].items()):
+                lines.append(f'wc_nocodb_http_retries_total'
+                             f'{labels(host=host, method=method, endpoint=endpoint, reason=reason)} {count}')
+
+        metric('rate_limit_wait_seconds_total', 'counter', 'Secondi di attesa del rate limiter')
+        for host, seconds in sorted(waits.items()):
+            lines.append(f'wc_nocodb_rate_limit_wait_seconds_total{labels(host=host)} {seconds:.6f}')
+
+        for name, (value, help_text) in (gauges or {}).items():
+            metric(name, 'gauge', help_text)
+            if isinstance(value, dict):
+                for store, store_value in sorted(value.items()):
+                    lines.append(f'wc_nocodb_{name}{labels(store=store)} {store_value}')
+            else:
+                lines.append(f'wc_nocodb_{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+_http_metrics = HttpMetrics()
+
+
+def _write_atomic(path: Path, content: str):
+    """Scrive su file temporaneo e rinomina (i lettori non vedono mai file a metà)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def export_metrics(config: Dict, summary: Dict, gauges: Dict[str, tuple]):
+    """
+    Scrive le metriche di un ciclo: riepilogo JSON + textfile Prometheus.
+
+    I percorsi vengono dalla sezione "metrics" (default: nella directory di stato).
+    """
+    metrics_config = config.get('metrics') or {}
+    json_path = Path(os.path.expanduser(metrics_config['json'])) if metrics_config.get('json') \
+        else state_path(config, METRICS_JSON_FILE)
+    prom_path = Path(os.path.expanduser(metrics_config['textfile'])) if metrics_config.get('textfile') \
+        else state_path(config, METRICS_PROM_FILE)
+
+    try:
+        _write_atomic(json_path, json.dumps({**summary, **_http_metrics.summary()}, indent=2))
+        _write_atomic(prom_path, _http_metrics.to_prometheus(gauges))
+        logger.debug(f"📈 Metriche salvate in {json_path} e {prom_path}")
+    except OSError as e:
+        logger.warning(f"⚠️ Impossibile salvare le metriche: {e}")
+
+
+# ============================================================================
+# TRASPORTO HTTP
+# ============================================================================
+
+# Default della sezione "http" di woocommerce/nocodb
+DEFAULT_HTTP_CONFIG = {
+    'pool_size': 10,         # connessioni keep-alive per host
+    'connect_timeout': 5.0,
+    'read_timeout': 30.0,
+}
+
+
+def build_session(http_config: Optional[Dict] = None, min_pool_size: int = 1) -> requests.Session:
+    """
+    Crea una Session con pool di connessioni dimensionato.
+
+    Nessun retry a livello di trasporto: errori di rete e status HTTP (429/5xx) li
+    ritenta solo request_with_backoff, coordinandoli con il rate limiter dell'host
+    (due livelli di retry moltiplicherebbero i tentativi su un host bloccato).
+
+    Args:
+        http_config: sezione "http" della configurazione (vedi DEFAULT_HTTP_CONFIG)
+        min_pool_size: connessioni minime (es. il numero di richieste in parallelo)
+    """
+    http_config = {**DEFAULT_HTTP_CONFIG, **(http_config or {})}
+    pool_size = max(int(http_config['pool_size']), min_pool_size)
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+        'User-Agent': 'wc-nocodb-sync',
+    })
+    return session
+
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url: str, http_config: Optional[Dict] = None, min_pool_size: int = 1) -> requests.Session:
+    """
+    Restituisce la Session condivisa per l'host di `url` (creandola se serve).
+
+    Con più negozi nello stesso processo i client verso lo stesso host (tipicamente
+    NocoDB) usano un solo pool di connessioni, ingrandito per la somma delle loro
+    richieste in parallelo. L'autenticazione va passata per richiesta, non sulla Session.
+    """
+    host = urlparse(url).netloc
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = build_session(http_config, min_pool_size)
+            session.min_pool_size = min_pool_size
+            return session
+
+        session.min_pool_size += min_pool_size
+        pool_size = max(int({**DEFAULT_HTTP_CONFIG, **(http_config or {})}['pool_size']), session.min_pool_size)
+        if pool_size > session.get_adapter(url).poolmanager.connection_pool_kw['maxsize']:
+            retry = session.get_adapter(url).max_retries
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+
+
+def http_timeout(http_config: Optional[Dict] = None) -> tuple:
+    """Timeout (connect, read) per requests"""
+    http_config = {**DEFAULT_HTTP_CONFIG, **(http_config or {})}
+    return (float(http_config['connect_timeout']), float(http_config['read_timeout']))
+
+
 # ============================================================================
 # WOOCOMMERCE CLIENT
 # ============================================================================
 
+# Rate limit di default se la configurazione non li indica
+WC_DEFAULT_RATE_LIMIT = {'requests_per_second': 1.0, 'burst': 2}
+NOCODB_DEFAULT_RATE_LIMIT = {'requests_per_second': 5.0, 'burst': 5}
+
+# Massimo di id per `include=` (è anche il per_page massimo di WooCommerce)
+CUSTOMERS_PER_REQUEST = 100
+
+
 class WooCommerceClient:
     """Client per interagire con WooCommerce REST API v3"""
 
-    def __init__(self, store_url: str, consumer_key: str, consumer_secret: str):
+    def __init__(self, store_url: str, consumer_key: str, consumer_secret: str,
+                 rate_limit: Optional[Dict] = None, concurrency: int = 4,
+                 order_fields: Optional[List[str]] = None, http_config: Optional[Dict] = None):
         self.base_url = store_url.rstrip('/') + '/wp-json/wc/v3'
         self.auth = HTTPBasicAuth(consumer_key, consumer_secret)
-        self.session = requests.Session()
-        self.session.auth = self.auth
-        self.rate_limit_wait = 5  # secondi di attesa se rate limited
+        self.concurrency = max(1, concurrency)  # pagine scaricate in parallelo
+        self.session = get_session(self.base_url, http_config, min_pool_size=self.concurrency)
+        self.timeout = http_timeout(http_config)
+        self.limiter = get_rate_limiter(self.base_url, rate_limit)
+        self.max_retries = (rate_limit or {}).get('max_retries', 5)
+        self.order_fields = order_fields  # proiezione _fields (None = ordine completo)
+
+    def _get(self, endpoint: str, params: Dict = None) -> requests.Response:
+        """GET con rate limiting e retry; solleva HTTPError se la risposta è un errore"""
+        response = request_with_backoff(
+            self.session, self.limiter, 'GET', f"{self.base_url}{endpoint}",
+            max_retries=self.max_retries, params=params, timeout=self.timeout, auth=self.auth
+        )
+        response.raise_for_status()
+        return response
 
-    def get_orders(self, statuses: List[str] = None, days_back: int = 7) -> List[Dict]:
+    def get_orders(self, statuses: List[str] = None, days_back: int = 7,
+                   modified_after: Optional[str] = None) -> List[Dict]:
         """
-        Recupera ordini da WooCommerce.
+        Recupera ordini da WooCommerce (tutti in memoria, vedi iter_orders per lo streaming).
 
         Args:
             statuses: Lista di stati ('processing', 'pending', 'on-hold', etc.)
-            days_back: Recupera ordini modificati negli ultimi N giorni
+            days_back: Recupera ordini modificati negli ultimi N giorni (>= 1000 = tutti)
+            modified_after: Data GMT ISO8601 di partenza; se indicata ha la precedenza su days_back
 
         Returns:
             Lista di ordini con tutti i dettagli
         """
+        return [
+            order
+            for page in self.iter_orders(statuses, days_back, modified_after)
+            for order in page
+        ]
+
+    def iter_orders(self, statuses: List[str] = None, days_back: int = 7,
+                    modified_after: Optional[str] = None, created_after: Optional[str] = None,
+                    created_before: Optional[str] = None, fields: Optional[List[str]] = None) -> Iterator[List[Dict]]:
+        """
+        Scarica gli ordini da WooCommerce restituendoli una pagina alla volta.
+
+        Il filtro sulla data di modifica è applicato lato server (`modified_after`),
+        così non serve scorrere tutto lo storico. Le pagine sono ordinate per id, che
+        non cambia: con l'ordinamento per `modified` un ordine modificato durante lo
+        scaricamento si sposterebbe in fondo e farebbe saltare quello al confine di
+        pagina (la paginazione è per offset). Dopo la prima pagina le successive vengono scaricate in parallelo, con al
+        massimo `concurrency` pagine in volo: la memoria resta limitata e le pagine
+        escono nell'ordine corretto.
+
+        Args:
+            statuses: Lista di stati ('processing', 'pending', 'on-hold', etc.)
+            days_back: Recupera ordini modificati negli ultimi N giorni (>= 1000 = tutti)
+            modified_after: Data GMT ISO8601 di partenza; se indicata ha la precedenza su days_back
+            created_after / created_before: Finestra (esclusa) sulla data di creazione GMT
+            fields: Proiezione `_fields` al posto di quella del client (es. solo id/stato)
+
+        Yields:
+            Pagine di ordini (liste di dict)
+        """
         if statuses is None:
             statuses = ['processing', 'pending', 'on-hold']
 
-        all_orders = []
-        page = 1
         per_page = 100
+        total = 0
 
-        # Calcola data limite
-        cutoff_date = (datetime.utcnow() - timedelta(days=days_back)).isoformat()
+        # Calcola data limite (solo per sync incrementale)
+        if modified_after is None and days_back < 1000:
+            modified_after = (datetime.utcnow() - timedelta(days=days_back)).replace(microsecond=0).isoformat()
 
-        while True:
-            params = {
-                'status': ','.join(statuses),
-                'per_page': per_page,
-                'page': page,
-                'orderby': 'date',
-                'order': 'desc'
-            }
+        params = {
+            'status': ','.join(statuses),
+            'per_page': per_page,
+            'orderby': 'id',
+            'order': 'asc'
+        }
+        if modified_after:
+            params['modified_after'] = modified_after
+        if created_after:
+            params['after'] = created_after
+        if created_before:
+            params['before'] = created_before
+        if modified_after or created_after or created_before:
+            params['dates_are_gmt'] = 'true'
+        if fields or self.order_fields:
+            params['_fields'] = ','.join(fields or self.order_fields)
 
-            try:
-                logger.info(f"📦 Recuperando ordini da WooCommerce (pagina {page})...")
-                response = self.session.get(
-                    f"{self.base_url}/orders",
-                    params=params,
-                    timeout=10
-                )
+        try:
+            # Prima pagina: ci dice anche quante pagine ci sono in totale
+            response = self._get_orders_page(params, 1)
+            orders = response.json()
+            total += len(orders)
+            yield orders
 
-                if response.status_code == 429:  # Rate limit
-                    logger.warning(f"⏱️ Rate limit raggiunto, attendo {self.rate_limit_wait}s...")
-                    time.sleep(self.rate_limit_wait)
-                    continue
+            total_pages = response.headers.get('X-WP-TotalPages')
+            if total_pages is not None:
+                logger.info(f"📦 {response.headers.get('X-WP-Total', '?')} ordini in {total_pages} pagine")
+                pages = iter(range(2, int(total_pages) + 1))
 
-                response.raise_for_status()
-                orders = response.json()
+                # Finestra scorrevole di richieste in volo, consumate nell'ordine delle pagine
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    window = deque(
+                        executor.submit(self._get_orders_page, params, page)
+                        for page in itertools.islice(pages, self.concurrency)
+                    )
+                    while window:
+                        orders = window.popleft().result().json()
+                        next_page = next(pages, None)
+                        if next_page is not None:
+                            window.append(executor.submit(self._get_orders_page, params, next_page))
+                        total += len(orders)
+                        yield orders
+            else:
+                # Header assente (proxy/plugin che lo rimuovono): pagine in sequenza
+                page = 1
+                while len(orders) == per_page:
+                    page += 1
+                    orders = self._get_orders_page(params, page).json()
+                    total += len(orders)
+                    yield orders
 
-                if not orders:
-                    break
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Errore recuperando ordini WooCommerce: {e}")
+            raise
 
-                # Filtra ordini per data di modifica e stato
-                # Se full_sync: prendi tutti
-                # Altrimenti: solo ultimi 7 giorni + stato processing/pending
-                if days_back >= 1000:  # full_sync
-                    filtered_orders = orders
-                else:
-                    filtered_orders = [
-                        o for o in orders
-                        if o['date_modified'] >= cutoff_date and o['status'] in ['processing', 'pending']
-                    ]
-
-                all_orders.extend(filtered_orders)
-
-                # Se meno di per_page risultati, siamo alla fine
-                if len(orders) < per_page:
-                    break
+        logger.info(f"✅ Recuperati {total} ordini da WooCommerce")
+
+    def iter_orders_by_ids(self, order_ids: Iterable[int], fields: Optional[List[str]] = None) -> Iterator[List[Dict]]:
+        """
+        Scarica ordini specifici con `include=` (100 per richiesta, qualsiasi stato
+        tranne trash), con al massimo `concurrency` richieste in volo.
 
-                page += 1
-                time.sleep(1.0)  # Rate limit gentile
+        Args:
+            order_ids: Id degli ordini
+            fields: Proiezione `_fields` al posto di quella del client (es. solo id)
 
-            except requests.exceptions.RequestException as e:
-                logger.error(f"❌ Errore recuperando ordini WooCommerce: {e}")
-                raise
+        Yields:
+            Pagine di ordini (liste di dict)
+        """
+        ids = sorted({int(order_id) for order_id in order_ids})
+        chunks = iter([ids[start:start + 100] for start in range(0, len(ids), 100)])
+
+        def fetch(chunk: List[int]) -> List[Dict]:
+            params = {'include': ','.join(map(str, chunk)), 'per_page': 100, 'orderby': 'modified', 'order': 'asc'}
+            if fields or self.order_fields:
+                params['_fields'] = ','.join(fields or self.order_fields)
+            return self._get('/orders', params=params).json()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                window = deque(executor.submit(fetch, chunk) for chunk in itertools.islice(chunks, self.concurrency))
+                while window:
+                    orders = window.popleft().result()
+                    next_chunk = next(chunks, None)
+                    if next_chunk is not None:
+                        window.append(executor.submit(fetch, next_chunk))
+                    yield orders
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Errore recuperando ordini WooCommerce per id: {e}")
+            raise
+
+    def get_first_order_date(self, statuses: List[str]) -> Optional[str]:
+        """Data di creazione GMT dell'ordine più vecchio con uno degli stati indicati (None se nessuno)"""
+        params = {
+            'status': ','.join(statuses),
+            'per_page': 1,
+            'orderby': 'date',
+            'order': 'asc',
+            '_fields': 'id,date_created_gmt'
+        }
+        orders = self._get('/orders', params=params).json()
+        return orders[0].get('date_created_gmt') if orders else None
+
+    def _get_orders_page(self, params: Dict, page: int) -> requests.Response:
+        """Scarica una singola pagina di ordini"""
+        _log_sampler.log('pagine ordini', f"📦 Recuperando ordini da WooCommerce (pagina {page})...")
+        return self._get('/orders', params={**params, 'page': page})
+
+    def get_customers(self, customer_ids: Iterable[int], fields: Optional[List[str]] = None) -> Dict[int, Dict]:
+        """
+        Recupera più clienti con `include=`, fino a CUSTOMERS_PER_REQUEST id per chiamata
+        (blocchi scaricati in parallelo, come le pagine ordini).
+
+        Args:
+            customer_ids: Id cliente WooCommerce (0/None = ospite, ignorati)
+            fields: proiezione `_fields` (None = cliente completo)
+
+        Returns:
+            id → cliente; gli id inesistenti non compaiono
+        """
+        ids = sorted({int(customer_id) for customer_id in customer_ids if customer_id})
+        chunks = [ids[start:start + CUSTOMERS_PER_REQUEST] for start in range(0, len(ids), CUSTOMERS_PER_REQUEST)]
 
-        logger.info(f"✅ Recuperati {len(all_orders)} ordini da WooCommerce")
-        return all_orders
+        def fetch(chunk: List[int]) -> List[Dict]:
+            # role=all: di default l'endpoint restituisce solo il ruolo "customer"
+            params = {'include': ','.join(map(str, chunk)), 'per_page': CUSTOMERS_PER_REQUEST, 'role': 'all'}
+            if fields:
+                params['_fields'] = ','.join(fields)
+            return self._get('/customers', params=params).json()
+
+        customers = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for page in executor.map(fetch, chunks):
+                    for customer in page:
+                        customers[int(customer['id'])] = customer
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Errore recuperando clienti WooCommerce: {e}")
+            raise
+
+        logger.debug(f"👤 Scaricati {len(customers)}/{len(ids)} clienti in {len(chunks)} richieste")
+        return customers
 
     def get_customer_by_id(self, customer_id: int) -> Dict:
-        """Recupera dati cliente da WooCommerce"""
+        """
+        Recupera dati cliente da WooCommerce.
+
+        Returns:
+            Il cliente, o {} se non esiste (es. cliente cancellato)
+
+        Raises:
+            requests.exceptions.RequestException: per gli altri errori (dopo i retry)
+        """
+        try:
+            return self._get(f'/customers/{customer_id}').json()
+        except requests.exceptions.RequestException as e:
+            if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 404:
+                logger.debug(f"🔍 Cliente {customer_id} non trovato in WooCommerce")
+                return {}
+            logger.error(f"❌ Errore recuperando cliente {customer_id}: {e}")
+            raise
+
+
+# ============================================================================
+# NOCODB CLIENT
+# ============================================================================
+
+class NocODBClient:
+    """Client per interagire con NocoDB API v2"""
+
+    def __init__(self, base_url: str, token: str, batch_size: int = 100,
+                 rate_limit: Optional[Dict] = None, http_config: Optional[Dict] = None):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.batch_size = batch_size  # record per richiesta bulk
+        self.limiter = get_rate_limiter(self.base_url, rate_limit)
+        self.max_retries = (rate_limit or {}).get('max_retries', 5)
+        # Pipeline: lettura/scrittura clienti nel thread principale + writer in background
+        self.session = get_session(self.base_url, http_config, min_pool_size=2)
+        self.timeout = http_timeout(http_config)
+        self.headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+
+    def _request(self, method: str, endpoint: str, **kwargs) -> Dict:
+        """Helper per fare richieste autenticate"""
+        url = f"{self.base_url}{endpoint}"
+
         try:
-            response = self.session.get(
-                f"{self.base_url}/customers/{customer_id}",
-                timeout=10
+            response = request_with_backoff(
+                self.session, self.limiter, method, url,
+                max_retries=self.max_retries, timeout=self.timeout, headers=self.headers, **kwargs
             )
+
+            if response.status_code == 401:
+                raise ValueError("Token NocoDB non valido o scaduto")
+
             response.raise_for_status()
-            return response.json()
+            return response.json() if response.text else {}
+
         except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Errore recuperando cliente {customer_id}: {e}")
-            return {}
+            logger.error(f"❌ Errore NocoDB ({method} {endpoint}): {e}")
+            raise
+
+    def iter_table_records(self, table_id: str, fields: List[str] = None,
+                           filters: str = None, page_size: int = 1000) -> Iterator[Dict]:
+        """
+        Scorre tutti i record di una tabella NocoDB, una pagina alla volta.
+
+        Args:
+            table_id: ID della tabella
+            fields: Colonne da richiedere (None = tutte)
+            filters: Query filter in formato NocoDB
+            page_size: Record per pagina (max 1000 su NocoDB)
+
+        Yields:
+            Singoli record
+        """
+        offset = 0
+
+        while True:
+            params = {'limit': page_size, 'offset': offset}
+            if fields:
+                params['fields'] = ','.join(fields)
+            if filters:
+                params['where'] = filters
+
+            result = self._request('GET', f'/tables/{table_id}/records', params=params)
+            records = result.get('list', [])
+            yield from records
+
+            page_info = result.get('pageInfo', {})
+            if not records or page_info.get('isLastPage', len(records) < page_size):
+                break
+
+            offset += len(records)
+
+    def build_index(self, table_id: str, key_field: str, fields: List[str] = None,
+                    normalize: Callable[[Any], str] = str) -> Dict[str, Dict]:
+        """
+        Precarica una tabella in un dizionario indicizzato per `key_field`.
+
+        Args:
+            table_id: ID della tabella
+            key_field: Colonna usata come chiave (es. 'Email', 'Order Number')
+            fields: Colonne aggiuntive da conservare oltre a Id e chiave
+            normalize: Funzione di normalizzazione della chiave
+
+        Returns:
+            Dizionario chiave → record (solo le colonne richieste)
+        """
+        columns = ['Id', key_field] + [f for f in (fields or []) if f not in ('Id', key_field)]
+        index = {}
+
+        for record in self.iter_table_records(table_id, fields=columns):
+            key = record.get(key_field)
+            if key in (None, ''):
+                continue
+            # In caso di duplicati in NocoDB vince il primo record (come prima con records[0])
+            index.setdefault(normalize(key), record)
+
+        logger.info(f"🗂️ Indicizzati {len(index)} record da {table_id} per '{key_field}'")
+        return index
+
+    def get_table_records(self, table_id: str, filters: str = None, limit: int = 1000) -> List[Dict]:
+        """
+        Recupera record da una tabella NocoDB.
+
+        Args:
+            table_id: ID della tabella
+            filters: Query filter in formato NocoDB
+            limit: Numero massimo di record
+
+        Returns:
+            Lista di record
+        """
+        params = {'limit': limit}
+        if filters:
+            params['where'] = filters
+
+        try:
+            result = self._request('GET', f'/tables/{table_id}/records', params=params)
+            return result.get('list', [])
+        except Exception as e:
+            logger.warning(f"⚠️ Errore nel recupero record da {table_id}: {e}")
+            return []
+
+    def create_record(self, table_id: str, data: Dict) -> Optional[Dict]:
+        """Crea un nuovo record in NocoDB"""
+        try:
+            result = self._request('POST', f'/tables/{table_id}/records', json=data)
+            logger.debug(f"✅ Record creato in {table_id}: {result.get('Id', 'N/A')}")
+            return result
+        except Exception as e:
+            logger.error(f"❌ Errore creando record in {table_id}: {e}")
+            return None
+
+    def update_record(self, table_id: str, record_id: str, data: Dict) -> Optional[Dict]:
+        """Aggiorna un record in NocoDB con fallback a INSERT se record non esiste"""
+        try:
+            result = self._request('PATCH', f'/tables/{table_id}/records/{record_id}', json=data)
+            logger.debug(f"✅ Record {record_id} aggiornato in {table_id}")
+            return result
+        except requests.exceptions.HTTPError as e:
+            # Se il record non esiste (404), prova a crearlo (INSERT fallback)
+            if e.response.status_code == 404:
+                logger.warning(f"⚠️ Record {record_id} non trovato (404), fallback a INSERT...")
+                return self.create_record(table_id, data)
+            # Per altri errori HTTP, log e ritorna None
+            logger.error(f"❌ Errore aggiornando record {record_id} in {table_id}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Errore aggiornando record {record_id} in {table_id}: {e}")
+            return None
+
+    def bulk_create(self, table_id: str, rows: List[Dict], chunk_size: int = None,
+                    key_field: Optional[str] = None) -> Dict[str, List]:
+        """
+        Crea più record in NocoDB inviando array di righe (POST /tables/{id}/records).
+
+        Se NocoDB rifiuta un chunk (4xx di validazione), le sue righe vengono ritentate
+        una alla volta per isolare quelle effettivamente in errore. Su timeout, errori
+        di rete o 5xx il chunk potrebbe essere già stato scritto: con `key_field` si
+        cerca in NocoDB quali righe esistono già e si inseriscono solo le mancanti,
+        altrimenti il chunk viene segnato come fallito (mai reinserito alla cieca).
+
+        Args:
+            table_id: ID della tabella
+            rows: Righe da creare
+            chunk_size: Righe per richiesta (default: self.batch_size)
+            key_field: Colonna che identifica una riga (es. 'Email'), per la verifica dopo un errore ambiguo
+
+        Returns:
+            {'created': [(riga, record)], 'failed': [(riga, errore)]}
+        """
+        chunk_size = chunk_size or self.batch_size
+        result = {'created': [], 'failed': []}
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            try:
+                records = self._request('POST', f'/tables/{table_id}/records', json=chunk)
+                check_bulk_response(chunk, records)
+                result['created'].extend(zip(chunk, records))
+                logger.debug(f"✅ Creati {len(chunk)} record in {table_id}")
+                continue
+            except Exception as e:
+                error = e
+
+            if not is_rejected_request(error):
+                if key_field is None:
+                    logger.error(f"❌ Bulk INSERT in {table_id} ({len(chunk)} righe) con esito incerto: {error}")
+                    result['failed'].extend((row, str(error)) for row in chunk)
+                    continue
+                try:
+                    existing = self._find_existing(table_id, key_field, chunk)
+                except Exception as e:
+                    logger.error(f"❌ Bulk INSERT in {table_id} ({len(chunk)} righe) con esito incerto: {error}; "
+                                 f"verifica fallita: {e}")
+                    result['failed'].extend((row, str(error)) for row in chunk)
+                    continue
+                result['created'].extend((row, existing[str(row[key_field])]) for row in chunk
+                                         if str(row[key_field]) in existing)
+                chunk = [row for row in chunk if str(row[key_field]) not in existing]
+                logger.warning(f"⚠️ Bulk INSERT con esito incerto in {table_id}: {len(existing)} righe già scritte, "
+                               f"riprovo le altre {len(chunk)} riga per riga...")
+            else:
+                logger.warning(f"⚠️ Bulk INSERT rifiutato in {table_id} ({len(chunk)} righe): {error}, "
+                               f"riprovo riga per riga...")
+
+            for row in chunk:
+                try:
+                    records = self._request('POST', f'/tables/{table_id}/records', json=[row])
+                    result['created'].append((row, records[0]))
+                except Exception as e:
+                    logger.error(f"❌ Errore creando record in {table_id}: {e}")
+                    result['failed'].append((row, str(e)))
+
+        return result
+
+    def _find_existing(self, table_id: str, key_field: str, rows: List[Dict]) -> Dict[str, Dict]:
+        """
+        Record già presenti in NocoDB per le chiavi di `rows` (chiave come stringa → record).
+
+        Il filtro `where` non ha escape: le chiavi con caratteri che ne romperebbero la
+        sintassi (es. una virgola in un'email) vengono cercate una alla volta con `like`
+        sul frammento più lungo senza quei caratteri, e confrontate esattamente qui.
+        """
+        keys = {str(row[key_field]) for row in rows}
+        safe = [key for key in keys if not WHERE_UNSAFE.search(key)]
+        existing = {}
+
+        if safe:
+            filters = '~or'.join(f"({key_field},eq,{key})" for key in safe)
+            for record in self.iter_table_records(table_id, fields=['Id', key_field], filters=filters):
+                existing[str(record.get(key_field))] = record
+
+        for key in keys.difference(safe):
+            fragment = max(WHERE_UNSAFE.split(key), key=len)
+            filters = f"({key_field},like,%{fragment}%)" if fragment else None
+            for record in self.iter_table_records(table_id, fields=['Id', key_field], filters=filters):
+                if str(record.get(key_field)) == key:
+                    existing[key] = record
+
+        return {key: record for key, record in existing.items() if key in keys}
+
+    def bulk_update(self, table_id: str, rows: List[Dict], chunk_size: int = None) -> Dict[str, List]:
+        """
+        Aggiorna più record in NocoDB inviando array di righe (PATCH /tables/{id}/records).
+
+        Ogni riga deve contenere la chiave 'Id'. Se un chunk fallisce (es. 404 perché
+        un record non esiste più), le sue righe vengono ritentate una alla volta con
+        fallback a INSERT per quelle non trovate.
+
+        Args:
+            table_id: ID della tabella
+            rows: Righe da aggiornare (con 'Id')
+            chunk_size: Righe per richiesta (default: self.batch_size)
+
+        Returns:
+            {'updated': [(riga, record)], 'created': [(riga, record)], 'failed': [(riga, errore)]}
+        """
+        chunk_size = chunk_size or self.batch_size
+        result = {'updated': [], 'created': [], 'failed': []}
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            try:
+                records = self._request('PATCH', f'/tables/{table_id}/records', json=chunk)
+                check_bulk_response(chunk, records)
+                result['updated'].extend(zip(chunk, records))
+                logger.debug(f"✅ Aggiornati {len(chunk)} record in {table_id}")
+                continue
+            except Exception as e:
+                logger.warning(f"⚠️ Bulk UPDATE fallito in {table_id} ({len(chunk)} righe): {e}, riprovo riga per riga...")
+
+            for row in chunk:
+                try:
+                    records = self._request('PATCH', f'/tables/{table_id}/records', json=[row])
+                    result['updated'].append((row, records[0]))
+                except requests.exceptions.HTTPError as e:
+                    # Se il record non esiste (404), prova a crearlo (INSERT fallback)
+                    if e.response is not None and e.response.status_code == 404:
+                        logger.warning(f"⚠️ Record {row.get('Id')} non trovato (404), fallback a INSERT...")
+                        data = {k: v for k, v in row.items() if k != 'Id'}
+                        created = self.bulk_create(table_id, [data], chunk_size=1)
+                        result['created'].extend(created['created'])
+                        result['failed'].extend(created['failed'])
+                    else:
+                        logger.error(f"❌ Errore aggiornando record {row.get('Id')} in {table_id}: {e}")
+                        result['failed'].append((row, str(e)))
+                except Exception as e:
+                    logger.error(f"❌ Errore aggiornando record {row.get('Id')} in {table_id}: {e}")
+                    result['failed'].append((row, str(e)))
+
+        return result
+
+    def bulk_delete(self, table_id: str, record_ids: List[Any], chunk_size: int = None) -> int:
+        """
+        Elimina record in blocco (DELETE con array di {'Id': ...}).
+
+        Returns:
+            Numero di record eliminati
+        """
+        chunk_size = chunk_size or self.batch_size
+        deleted = 0
+
+        for start in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[start:start + chunk_size]
+            try:
+                self._request('DELETE', f'/tables/{table_id}/records', json=[{'Id': record_id} for record_id in chunk])
+                deleted += len(chunk)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"❌ Errore eliminando {len(chunk)} record da {table_id}: {e}")
+
+        return deleted
+
+    def get_record_by_email(self, table_id: str, email: str) -> Optional[Dict]:
+        """Trova un record cliente per email"""
+        try:
+            records = self.get_table_records(table_id, filters=f"(Email,eq,{email})")
+            return records[0] if records else None
+        except Exception as e:
+            logger.warning(f"⚠️ Errore cercando cliente con email {email}: {e}")
+            return None
+
+    def get_record_by_field(self, table_id: str, field: str, value: Any) -> Optional[Dict]:
+        """Trova un record per un campo specifico"""
+        try:
+            records = self.get_table_records(table_id, filters=f"({field},eq,{value})")
+            if records:
+                record = records[0]
+                logger.debug(f"🔍 Trovato record per {field}={value}: ID={record.get('Id', 'N/A')}")
+                return record
+            else:
+                logger.debug(f"🔍 Nessun record trovato per {field}={value}")
+                return None
+        except Exception as e:
+            logger.warning(f"⚠️ Errore cercando {field}={value} in {table_id}: {e}")
+            return None
+
+
+# ============================================================================
+# STATO LOCALE
+# ============================================================================
+
+DEFAULT_STATE_DIR = '~/.wc-nocodb-sync'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# Margine di sovrapposizione tra un run e l'altro (gli ordini ripetuti sono idempotenti)
+CHECKPOINT_OVERLAP = timedelta(minutes=1)
+
+
+def state_path(config: Dict, filename: str) -> Path:
+    """Percorso di un file di stato locale (crea la directory se necessario)"""
+    state_dir = Path(os.path.expanduser(config.get('state_dir', DEFAULT_STATE_DIR)))
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return state_dir / filename
+
+
+def load_checkpoint(config: Dict) -> Optional[str]:
+    """Legge il checkpoint (inizio GMT dell'ultimo sync riuscito)"""
+    path = state_path(config, CHECKPOINT_FILE)
+    if not path.exists():
+        return None
+
+    try:
+        with open(path) as f:
+            return json.load(f).get('last_modified_gmt')
+    except Exception as e:
+        logger.warning(f"⚠️ Checkpoint {path} illeggibile, lo ignoro: {e}")
+        return None
+
+
+def save_checkpoint(config: Dict, last_modified_gmt: str):
+    """Salva il checkpoint in modo atomico"""
+    path = state_path(config, CHECKPOINT_FILE)
+    tmp_path = path.with_suffix('.tmp')
+
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'last_modified_gmt': last_modified_gmt,
+            'saved_at': datetime.utcnow().isoformat()
+        }, f)
+    os.replace(tmp_path, path)
+    logger.debug(f"💾 Checkpoint salvato: {last_modified_gmt}")
+
+
+STATE_DB_FILE = 'state.sqlite3'
+
+
+class StateStore:
+    """
+    Stato locale su SQLite: per ogni chiave (Email, Order Number) l'Id del record
+    NocoDB, l'hash dell'ultimo payload scritto e lo stato ordine.
+
+    Permette di decidere INSERT/UPDATE/skip senza chiamate di rete. Se il file va
+    perso si ricostruisce da NocoDB (vedi WCNocODBSyncer.rebuild_state).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()  # la connessione è condivisa con il thread writer
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                nocodb_id INTEGER NOT NULL,
+                payload_hash TEXT,
+                status TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+
+    def count(self, kind: str) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM records WHERE kind = ?', (kind,)).fetchone()[0]
+
+    @staticmethod
+    def _entry(nocodb_id: int, payload_hash_: Optional[str], status: Optional[str]) -> Dict:
+        entry = {'Id': nocodb_id, 'hash': payload_hash_}
+        if status is not None:
+            entry['Order Status'] = status
+        return entry
+
+    def load_index(self, kind: str, prefix: Optional[str] = None) -> Dict[str, Dict]:
+        """Carica tutte le chiavi di un tipo (o solo quelle con `prefix`): chiave → {'Id', 'hash', 'Order Status'}"""
+        query = 'SELECT key, nocodb_id, payload_hash, status FROM records WHERE kind = ?'
+        params = (kind,)
+        if prefix is not None:
+            query += ' AND substr(key, 1, ?) = ?'
+            params += (len(prefix), prefix)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        return {key: self._entry(nocodb_id, hash_, status) for key, nocodb_id, hash_, status in rows}
+
+    def get(self, kind: str, key: str) -> Optional[Dict]:
+        """Voce di una singola chiave, None se non presente"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT nocodb_id, payload_hash, status FROM records WHERE kind = ? AND key = ?', (kind, key)
+            ).fetchone()
+        return self._entry(*row) if row else None
+
+    def put_many(self, kind: str, rows: List[tuple]):
+        """Salva righe (chiave, Id NocoDB, hash, stato)"""
+        if not rows:
+            return
+        now = datetime.utcnow().isoformat()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO records (kind, key, nocodb_id, payload_hash, status, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(kind, key, nocodb_id, hash_, status, now) for key, nocodb_id, hash_, status in rows]
+            )
+            self.conn.commit()
+
+    def delete_many(self, kind: str, keys: Iterable[str]):
+        """Elimina le chiavi indicate (record rimossi da NocoDB)"""
+        with self.lock:
+            self.conn.executemany('DELETE FROM records WHERE kind = ? AND key = ?', [(kind, key) for key in keys])
+            self.conn.commit()
+
+    def replace_all(self, kind: str, rows: List[tuple]):
+        """Sostituisce tutte le righe di un tipo (usato dal rebuild)"""
+        with self.lock:
+            self.conn.execute('DELETE FROM records WHERE kind = ?', (kind,))
+            self.conn.commit()
+        self.put_many(kind, rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CustomerCache:
+    """
+    Cache persistente dei clienti WooCommerce (nella stessa SQLite dello stato).
+
+    Le voci scadono dopo `ttl` secondi; oltre `max_entries` vengono eliminate le
+    meno usate di recente (LRU). Anche gli id inesistenti (clienti cancellati)
+    vengono ricordati, come voce vuota, per non richiederli a ogni run.
+    """
+
+    def __init__(self, state: StateStore, ttl: float = 86400, max_entries: int = 100000):
+        self.state = state
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with state.lock:
+            state.conn.execute('''
+                CREATE TABLE IF NOT EXISTS customers (
+                    customer_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            ''')
+            state.conn.execute('CREATE INDEX IF NOT EXISTS customers_used_at ON customers (used_at)')
+            state.conn.commit()
+
+    def get_many(self, customer_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Voci ancora valide per gli id richiesti (id → cliente, {} se inesistente)"""
+        ids = list(customer_ids)
+        now = time.time()
+        found = {}
+
+        with self.state.lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self.state.conn.execute(
+                    f'SELECT customer_id, data FROM customers '
+                    f'WHERE customer_id IN ({",".join("?" * len(chunk))}) AND fetched_at >= ?',
+                    (*chunk, now - self.ttl)
+                ).fetchall()
+                found.update((customer_id, json.loads(data)) for customer_id, data in rows)
+
+            if found:
+                self.state.conn.executemany(
+                    'UPDATE customers SET used_at = ? WHERE customer_id = ?',
+                    [(now, customer_id) for customer_id in found]
+                )
+                self.state.conn.commit()
+
+        return found
+
+    def put_many(self, customers: Dict[int, Dict]):
+        """Salva (o rinfresca) le voci e applica il limite LRU"""
+        if not customers:
+            return
+        now = time.time()
+
+        with self.state.lock:
+            self.state.conn.executemany(
+                'INSERT OR REPLACE INTO customers (customer_id, data, fetched_at, used_at) VALUES (?, ?, ?, ?)',
+                [(customer_id, json.dumps(data), now, now) for customer_id, data in customers.items()]
+            )
+            excess = self.state.conn.execute('SELECT COUNT(*) FROM customers').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.state.conn.execute(
+                    'DELETE FROM customers WHERE customer_id IN '
+                    '(SELECT customer_id FROM customers ORDER BY used_at LIMIT ?)', (excess,)
+                )
+            self.state.conn.commit()
+
+
+class PendingClienti:
+    """
+    Anagrafiche clienti raccolte dalle partizioni di un full sync, in attesa di
+    essere scritte in NocoDB quando tutte le partizioni sono completate.
+
+    Sta nella SQLite dello stato, così sopravvive a un full sync interrotto ed è
+    condivisa tra i processi worker. Per ogni email vince l'ordine modificato
+    più di recente, come nel sync in un unico flusso.
+    """
+
+    def __init__(self, state: StateStore):
+        self.state = state
+        with state.lock:
+            state.conn.execute('''
+                CREATE TABLE IF NOT EXISTS pending_clienti (
+                    email TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    customer_id INTEGER NOT NULL,
+                    modified TEXT NOT NULL
+                )
+            ''')
+            state.conn.commit()
+
+    def merge(self, clienti_da_sync: Dict[str, tuple]):
+        """Aggiunge le anagrafiche (email → (riga, customer_id, date_modified_gmt))"""
+        if not clienti_da_sync:
+            return
+        with self.state.lock:
+            self.state.conn.executemany(
+                'INSERT INTO pending_clienti (email, data, customer_id, modified) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (email) DO UPDATE SET data = excluded.data, customer_id = excluded.customer_id, '
+                'modified = excluded.modified WHERE excluded.modified >= pending_clienti.modified',
+                [(email, json.dumps(row), customer_id, modified)
+                 for email, (row, customer_id, modified) in clienti_da_sync.items()]
+            )
+            self.state.conn.commit()
+
+    def load(self) -> Dict[str, tuple]:
+        with self.state.lock:
+            rows = self.state.conn.execute('SELECT email, data, customer_id, modified FROM pending_clienti').fetchall()
+        return {email: (json.loads(data), customer_id, modified) for email, data, customer_id, modified in rows}
+
+    def clear(self):
+        with self.state.lock:
+            self.state.conn.execute('DELETE FROM pending_clienti')
+            self.state.conn.commit()
+
+
+FULL_SYNC_JOURNAL_FILE = 'full-sync-journal.json'
+
+
+def load_full_sync_journal(config: Dict) -> Optional[Dict]:
+    """Journal del full sync in corso (None se non c'è o è illeggibile)"""
+    path = state_path(config, FULL_SYNC_JOURNAL_FILE)
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Journal full sync illeggibile, riparto da zero: {e}")
+        return None
+
+
+def save_full_sync_journal(config: Dict, journal: Optional[Dict]):
+    """Salva il journal in modo atomico (None = full sync concluso, lo rimuove)"""
+    path = state_path(config, FULL_SYNC_JOURNAL_FILE)
+    if journal is None:
+        path.unlink(missing_ok=True)
+        return
+    _write_atomic(path, json.dumps(journal, indent=2))
+
+
+# Stati WooCommerce i cui importi non contano negli aggregati cliente
+UNCOUNTED_STATUSES = {'cancelled', 'refunded', 'failed', 'trash', 'checkout-draft'}
+
+
+class CustomerLedger:
+    """
+    Registro locale degli ordini già conteggiati negli aggregati clienti.
+
+    Per ogni ordine ricorda email, importo, rimborsi e se conta (in base allo
+    stato). Ogni run applica solo le differenze (nuovi ordini, cambi di stato,
+    rimborsi) e gli aggregati Orders/Total Spend si calcolano sull'intero
+    storico locale, non sulla finestra di ordini scaricata.
+    """
+
+    def __init__(self, state: StateStore):
+        self.state = state
+        with state.lock:
+            state.conn.execute('''
+                CREATE TABLE IF NOT EXISTS ledger (
+                    order_id INTEGER PRIMARY KEY,
+                    email TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    refunded REAL NOT NULL,
+                    counted INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+            state.conn.execute('CREATE INDEX IF NOT EXISTS ledger_email ON ledger (email)')
+
+            # date_modified_gmt dell'ordine (usato dalla riconciliazione); assente nei ledger più vecchi
+            columns = {row[1] for row in state.conn.execute('PRAGMA table_info(ledger)')}
+            if 'modified' not in columns:
+                state.conn.execute('ALTER TABLE ledger ADD COLUMN modified TEXT')
+
+            # Quando il ledger contiene tutto lo storico (full sync completato)
+            state.conn.execute('''
+                CREATE TABLE IF NOT EXISTS ledger_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            state.conn.commit()
+
+    def is_seeded(self) -> bool:
+        """
+        True se un full sync ha popolato il ledger con tutto lo storico.
+
+        Prima di allora gli aggregati coprono solo gli ordini scaricati finora
+        e non vanno scritti sopra i valori lifetime già presenti in NocoDB.
+        """
+        with self.state.lock:
+            return self.state.conn.execute("SELECT 1 FROM ledger_meta WHERE key = 'seeded_at'").fetchone() is not None
+
+    def mark_seeded(self):
+        with self.state.lock:
+            self.state.conn.execute(
+                "INSERT OR REPLACE INTO ledger_meta (key, value) VALUES ('seeded_at', ?)",
+                (datetime.utcnow().isoformat(),)
+            )
+            self.state.conn.commit()
+
+    def apply(self, wc_orders: List[Dict]) -> int:
+        """
+        Registra gli ordini (nuovi o modificati) nel ledger.
+
+        Returns:
+            Numero di ordini la cui voce è cambiata
+        """
+        entries = {}
+        for order in wc_orders:
+            email = _normalize_email(_pluck(order, 'billing.email'))
+            if not email or order.get('id') is None:
+                continue
+            refunded = sum(abs(_to_float(refund.get('total'))) for refund in order.get('refunds') or [])
+            entries[int(order['id'])] = (
+                email,
+                round(_to_float(order.get('total')), 2),
+                round(refunded, 2),
+                0 if order.get('status') in UNCOUNTED_STATUSES else 1,
+                order.get('date_modified_gmt')
+            )
+
+        if not entries:
+            return 0
+
+        now = datetime.utcnow().isoformat()
+        changed, rows = 0, []
+        with self.state.lock:
+            ids = list(entries)
+            existing = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for row in self.state.conn.execute(
+                    f'SELECT order_id, email, amount, refunded, counted, modified FROM ledger '
+                    f'WHERE order_id IN ({placeholders})',
+                    chunk
+                ):
+                    existing[row[0]] = tuple(row[1:])
+
+            for order_id, entry in entries.items():
+                previous = existing.get(order_id)
+                if previous != entry:
+                    rows.append((order_id, *entry, now))
+                    # Conta solo le voci cambiate negli importi/stato, non la sola data di modifica
+                    if previous is None or previous[:4] != entry[:4]:
+                        changed += 1
+
+            if rows:
+                self.state.conn.executemany(
+                    'INSERT OR REPLACE INTO ledger (order_id, email, amount, refunded, counted, modified, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+                self.state.conn.commit()
+
+        return changed
+
+    def remove(self, order_ids: Iterable[int]) -> set:
+        """
+        Elimina dal ledger gli ordini indicati (es. cancellati in WooCommerce).
+
+        Returns:
+            Email dei clienti i cui aggregati sono cambiati
+        """
+        ids = list(order_ids)
+        emails = set()
+        with self.state.lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                emails.update(row[0] for row in self.state.conn.execute(
+                    f'SELECT DISTINCT email FROM ledger WHERE order_id IN ({placeholders})', chunk
+                ))
+                self.state.conn.execute(f'DELETE FROM ledger WHERE order_id IN ({placeholders})', chunk)
+            self.state.conn.commit()
+        return emails
+
+    def totals(self, emails: Iterable[str]) -> Dict[str, tuple]:
+        """Aggregati lifetime per email: email → (numero ordini, totale speso al netto dei rimborsi)"""
+        emails = list(emails)
+        result = {email: (0, 0.0) for email in emails}
+
+        with self.state.lock:
+            for start in range(0, len(emails), 500):
+                chunk = emails[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for email, count, spend in self.state.conn.execute(
+                    f'SELECT email, COUNT(*), SUM(amount - refunded) FROM ledger '
+                    f'WHERE counted = 1 AND email IN ({placeholders}) GROUP BY email',
+                    chunk
+                ):
+                    result[email] = (count, round(spend or 0.0, 2))
+
+        return result
+
+
+FROZEN_FILE = 'frozen-orders.bin'
+
+# Stati NocoDB dopo i quali un ordine non viene più aggiornato
+FROZEN_STATUSES = ('Completed', 'Cancelled')
+
+
+class FrozenRegistry:
+    """
+    Registro compatto degli ordini frozen (Completed/Cancelled in NocoDB).
+
+    Su disco è un array ordinato di int64 (8 byte per ordine); in memoria la
+    ricerca è binaria. Gli ordini congelati durante il run vengono tenuti in un
+    piccolo set e fusi nell'array al salvataggio.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.ids = self._read()
+
+    def _read(self) -> array:
+        ids = array('q')
+        if self.path.exists():
+            try:
+                ids.frombytes(self.path.read_bytes())
+            except ValueError as e:
+                logger.warning(f"⚠️ Registro frozen {self.path} corrotto, lo ignoro: {e}")
+                return array('q')
+        return ids
+
+    def __contains__(self, order_id: Any) -> bool:
+        try:
+            order_id = int(order_id)
+        except (TypeError, ValueError):
+            return False
+        i = bisect_left(self.ids, order_id)
+        return (i < len(self.ids) and self.ids[i] == order_id) or order_id in self.pending
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.pending)
+
+    def add(self, order_id: Any):
+        try:
+            with self.lock:
+                self.pending.add(int(order_id))
+        except (TypeError, ValueError):
+            pass
+
+    def reload(self):
+        """Unisce gli ordini congelati nel frattempo da altri processi (file su disco)"""
+        with self.lock:
+            on_disk = self._read()
+            if on_disk != self.ids:
+                self.ids = array('q', sorted(set(self.ids) | set(on_disk)))
+
+    def remove(self, order_ids: Iterable[Any]):
+        """Toglie ordini dal registro, anche su disco (es. ordini eliminati da WooCommerce)"""
+        ids = set()
+        for order_id in order_ids:
+            try:
+                ids.add(int(order_id))
+            except (TypeError, ValueError):
+                continue
+        with self.lock:
+            # Il file viene unito prima di togliere gli id, altrimenti il prossimo save li rileggerebbe
+            merged = set(self.ids) | set(self._read()) | self.pending
+            if not merged & ids:
+                return
+            self.ids = array('q', sorted(merged - ids))
+            self.pending.clear()
+            data = self.ids.tobytes()
+        self._write(data)
+
+    def replace(self, order_ids: Iterable[Any]):
+        """Sostituisce il contenuto del registro, anche su disco (usato dal refresh da NocoDB)"""
+        ids = set()
+        for order_id in order_ids:
+            try:
+                ids.add(int(order_id))
+            except (TypeError, ValueError):
+                continue
+        with self.lock:
+            self.ids = array('q', sorted(ids))
+            self.pending.clear()
+            data = self.ids.tobytes()
+        self._write(data)
+
+    def save(self):
+        """
+        Fonde gli ordini congelati nel run e scrive il file in modo atomico.
+
+        Il file può essere stato aggiornato da un altro processo (cron, --serve,
+        --daemon) dopo la lettura: il suo contenuto viene riletto e unito, non sovrascritto.
+        """
+        with self.lock:
+            on_disk = self._read()
+            if self.pending or on_disk != self.ids:
+                self.ids = array('q', sorted(set(self.ids) | set(on_disk) | self.pending))
+                self.pending.clear()
+            data = self.ids.tobytes()
+        self._write(data)
+
+    def _write(self, data: bytes):
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.path)
+
+
+# Colonne escluse dall'hash: cambiano ad ogni run senza che il contenuto cambi
+VOLATILE_COLUMNS = {'Id', 'Last Active'}
+
+
+def _hash_value(value: Any) -> str:
+    """Normalizza un valore in modo che WooCommerce e NocoDB producano la stessa stringa"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        return f"{float(value):.2f}"
+    try:
+        return f"{float(value):.2f}"
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def payload_hash(row: Dict) -> str:
+    """Hash stabile del contenuto di una riga (campi vuoti e volatili ignorati)"""
+    normalized = {}
+    for column, value in row.items():
+        if column in VOLATILE_COLUMNS:
+            continue
+        value = _hash_value(value)
+        if value != '':
+            normalized[column] = value
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+# ============================================================================
+# MAPPING WOOCOMMERCE → NOCODB
+# ============================================================================
+
+def _normalize_email(value: Any) -> str:
+    return str(value or '').lower().strip()
+
+
+def _to_float(value: Any) -> float:
+    return float(value or 0)
+
+
+# Ogni voce: (colonna NocoDB, percorso/i nel JSON WooCommerce, conversione opzionale).
+# Con più percorsi la conversione riceve un argomento per percorso.
+ORDINI_MAPPING = [
+    ('Order Number', 'id', str),
+    ('Order Status', 'status', lambda v: (v or 'pending').capitalize()),
+    ('Order Date', 'date_created', None),
+    ('Order Total Amount', 'total', _to_float),
+    ('Payment Method Title', 'payment_method_title', None),
+    ('Customer Note', 'customer_note', None),
+    ('Email (Billing)', 'billing.email', _normalize_email),
+    ('First Name (Billing)', 'billing.first_name', None),
+    ('Last Name (Billing)', 'billing.last_name', None),
+    ('Phone (Billing)', 'billing.phone', None),
+    ('Country Code (Billing)', 'billing.country', None),
+    ('City (Billing)', 'billing.city', None),
+    ('Address 1&2 (Billing)', 'billing.address_1', None),
+    ('Postcode (Billing)', 'billing.postcode', None),
+]
+
+# Campi del primo prodotto (line_items[0])
+LINE_ITEM_MAPPING = [
+    ('Item Name', 'name', None),
+    ('Quantity (- Refund)', 'quantity', lambda v: v if v != '' else 1),
+    ('Item Cost', 'total', _to_float),
+]
+
+# Tabella Order Items (opzionale, nocodb.table_ids.order_items): una riga per
+# line item, collegata all'ordine tramite Order Number
+ORDER_ITEMS_MAPPING = [
+    ('Line Item Id', 'id', str),
+    ('Item Name', 'name', None),
+    ('Product Id', 'product_id', None),
+    ('Variation Id', 'variation_id', None),
+    ('SKU', 'sku', None),
+    ('Quantity', 'quantity', None),
+    ('Item Cost', 'total', _to_float),
+]
+
+# Campi custom da meta_data: chiave meta → colonna NocoDB
+META_MAPPING = {
+    'percorso': 'percorso',
+    '_data_partenza': 'data partenza',
+    'data_partenza': 'data partenza',
+}
+
+CLIENTI_MAPPING = [
+    ('Email', 'billing.email', _normalize_email),
+    ('Name', ('billing.first_name', 'billing.last_name'), lambda first, last: f"{first} {last}".strip()),
+    ('Username', 'billing.email', _normalize_email),
+    ('Phone (Billing)', 'billing.phone', None),
+    ('Country / Region', 'billing.country', None),
+    ('City', 'billing.city', None),
+    ('Postal Code', 'billing.postcode', None),
+]
+
+# Clienti: campi dal record cliente WooCommerce (solo clienti registrati, con
+# woocommerce.customers.enrich attivo); hanno la precedenza su CLIENTI_MAPPING
+CUSTOMER_MAPPING = [
+    ('Username', 'username', None),
+    ('Date Registered', 'date_created_gmt', None),
+    ('Role', 'role', None),
+]
+
+# Proiezione `_fields` per le richieste clienti
+CUSTOMER_FIELDS = ['id'] + [path for _, path, _ in CUSTOMER_MAPPING]
+
+# Campi letti direttamente dalla logica di sync (oltre a quelli dei mapping)
+ORDER_SYNC_FIELDS = ['id', 'status', 'total', 'refunds', 'date_modified_gmt', 'billing.email', 'customer_id']
+
+# Stati per cui un ordine viene inserito in Ordini (full sync / incrementale)
+FULL_SYNC_STATUSES = ['processing', 'pending', 'on-hold']
+INCREMENTAL_STATUSES = ['processing', 'pending']
+
+# Stati confrontati dalla riconciliazione: `any` = tutti, anche quelli aggiunti da
+# plugin, tranne trash (un ordine nel cestino o cancellato risulta assente da WooCommerce)
+RECONCILE_STATUSES = ['any']
+
+# Campi scaricati da WooCommerce per il confronto della riconciliazione
+RECONCILE_FIELDS = ['id', 'status', 'date_modified_gmt']
+
+# Stati scaricati in più per il ledger clienti: aggiornano ordini già presenti
+# in NocoDB (che poi diventano frozen) ma non creano nuovi record
+LEDGER_STATUSES = ['on-hold', 'completed', 'cancelled', 'refunded', 'failed']
+
+# Stati scaricati dal full sync (inseriti + solo ledger, senza doppioni)
+FULL_SYNC_FETCH_STATUSES = list(dict.fromkeys(FULL_SYNC_STATUSES + LEDGER_STATUSES))
+
+
+def _pluck(data: Any, path: str, default: Any = '') -> Any:
+    """Legge un campo annidato con notazione a punti ('billing.email')"""
+    for key in path.split('.'):
+        if not isinstance(data, dict):
+            return default
+        data = data.get(key)
+    return default if data is None else data
+
+
+def apply_mapping(data: Dict, mapping: List[tuple]) -> Dict:
+    """Applica un mapping (colonna, percorso/i, conversione) a un oggetto WooCommerce"""
+    row = {}
+    for column, paths, convert in mapping:
+        if isinstance(paths, tuple):
+            row[column] = convert(*(_pluck(data, path) for path in paths))
+        else:
+            value = _pluck(data, paths)
+            row[column] = convert(value) if convert else value
+    return row
+
+
+def order_item_key(order_number: Any, line_item_id: Any) -> str:
+    """Chiave nello stato locale di un line item: 'Order Number:Line Item Id'"""
+    return f"{str(order_number).strip()}:{str(line_item_id).strip()}"
+
+
+def order_status_label(status: Optional[str]) -> str:
+    """Valore di Order Status in NocoDB per uno stato WooCommerce (come da ORDINI_MAPPING)"""
+    mapping = [entry for entry in ORDINI_MAPPING if entry[0] == 'Order Status']
+    return apply_mapping({'status': status}, mapping)['Order Status']
+
+
+def order_fields_projection() -> List[str]:
+    """
+    Elenco `_fields` per le richieste ordini, derivato dai mapping.
+
+    I sotto-campi di oggetti (billing.*) si possono proiettare singolarmente;
+    line_items e meta_data sono array e vanno richiesti interi.
+    """
+    fields = set(ORDER_SYNC_FIELDS)
+    for mapping in (ORDINI_MAPPING, CLIENTI_MAPPING):
+        for _, paths, _ in mapping:
+            fields.update(paths if isinstance(paths, tuple) else (paths,))
+    if LINE_ITEM_MAPPING:
+        fields.add('line_items')
+    if META_MAPPING:
+        fields.add('meta_data')
+    return sorted(fields)
+
+
+# ============================================================================
+# PIPELINE
+# ============================================================================
+
+_END_OF_STREAM = object()
+
+
+def iterate_in_background(iterator: Iterator, maxsize: int = 4) -> Iterator:
+    """
+    Consuma `iterator` in un thread separato tenendo al massimo `maxsize` elementi in coda.
+
+    Permette di scaricare la pagina successiva mentre quella corrente viene elaborata.
+    Le eccezioni del producer vengono risollevate nel consumer; se il consumer si ferma,
+    il producer viene interrotto e l'iteratore chiuso.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    break
+            else:
+                put((_END_OF_STREAM, None))
+        except BaseException as e:
+            put((_END_OF_STREAM, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    thread = threading.Thread(target=producer, name='wc-fetch', daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _END_OF_STREAM:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class BackgroundWriter:
+    """
+    Esegue le scritture in un thread dedicato, con una coda limitata di job in attesa.
+
+    Con `threaded=False` i job vengono eseguiti subito nel thread chiamante
+    (usato dal profiling, per avere trasformazione e scrittura nello stesso profilo).
+    """
+
+    def __init__(self, maxsize: int = 4, threaded: bool = True):
+        self.jobs = queue.Queue(maxsize=maxsize)
+        self.error: Optional[BaseException] = None
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self._run, name='nocodb-writer', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if self.error is not None:
+                continue  # dopo un errore svuota la coda senza eseguire
+
+            fn, args = job
+            try:
+                fn(*args)
+            except BaseException as e:
+                self.error = e
+
+    def submit(self, fn: Callable, *args):
+        """Accoda un job (blocca se la coda è piena)"""
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            fn(*args)
+            return
+        self.jobs.put((fn, args))
+
+    def close(self):
+        """Attende la fine dei job accodati e risolleva l'eventuale errore"""
+        if self.thread is None:
+            return
+        self.jobs.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# ============================================================================
+# REGISTRAZIONE E REPLAY
+# ============================================================================
+
+RECORDING_SUFFIX = '.ndjson.gz'
+
+# Numerazione dei file registrati, unica nel processo (anche con più syncer, es. worker del full sync)
+_recording_sequence = itertools.count(1)
+
+
+class PageRecorder:
+    """
+    Registra le pagine di ordini WooCommerce così come arrivano (--record DIR).
+
+    Ogni flusso sincronizzato (sync incrementale, partizione del full sync, ordini
+    della riconciliazione, batch webhook) diventa un file NDJSON compresso: una riga
+    di intestazione e poi una riga per pagina (l'array JSON ricevuto da WooCommerce).
+    I file si rileggono con --replay, in ordine di nome.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(os.path.expanduser(directory))
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def record(self, pages: Iterator[List[Dict]], insert_statuses: Optional[Iterable[str]] = None
+               ) -> Iterator[List[Dict]]:
+        """Restituisce le stesse pagine, scrivendole su file man mano che passano (nessun file se tutte vuote)"""
+        header = {
+            'recorded_at': datetime.utcnow().isoformat(),
+            'insert_statuses': list(insert_statuses) if insert_statuses is not None else None,
+        }
+        path, f, count = None, None, 0
+
+        try:
+            for page in pages:
+                # Le pagine vuote non contengono ordini: niente file né righe per loro
+                if page:
+                    if f is None:
+                        path = self.directory / (f"{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}-"
+                                                 f"{next(_recording_sequence):04d}{RECORDING_SUFFIX}")
+                        f = gzip.open(path, 'wt', encoding='utf-8')
+                        f.write(json.dumps(header) + '\n')
+                    f.write(json.dumps(page, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    count += len(page)
+                yield page
+        finally:
+            if f is not None:
+                f.close()
+                logger.info(f"⏺️ Registrati {count} ordini in {path}")
+
+
+def list_recordings(directory: str) -> List[Path]:
+    """File registrati con --record, nell'ordine in cui sono stati scritti"""
+    return sorted(Path(os.path.expanduser(directory)).glob(f'*{RECORDING_SUFFIX}'))
+
+
+def open_recording(path: Path) -> Tuple[Dict, Iterator[List[Dict]]]:
+    """
+    Apre un file registrato: intestazione + iteratore delle pagine.
+
+    Le pagine vengono lette e decodificate una alla volta, senza caricare il file in memoria.
+    """
+    f = gzip.open(path, 'rt', encoding='utf-8')
+    first = json.loads(f.readline() or '{}')
+    header = first if isinstance(first, dict) else {}
+
+    def pages() -> Iterator[List[Dict]]:
+        with f:
+            if isinstance(first, list):
+                yield first
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, pages()
+
+
+# Funzioni per stadio nel riepilogo del profilo (--profile)
+PROFILE_WRITE_FUNCTIONS = ('_flush_writes', '_flush_order_items')
+PROFILE_READ_FUNCTIONS = ('iterate_in_background',)
+
+
+def summarize_profile(profiler: cProfile.Profile) -> Dict[str, float]:
+    """Secondi per stadio: lettura (attesa delle pagine), trasformazione e scrittura NocoDB"""
+    stats = pstats.Stats(profiler).stats
+    cumulative = {}
+    for (_, _, function), (_, _, _, cumtime, _) in stats.items():
+        cumulative[function] = cumulative.get(function, 0.0) + cumtime
+
+    total = cumulative.get('sync_stream', 0.0)
+    write = sum(cumulative.get(function, 0.0) for function in PROFILE_WRITE_FUNCTIONS)
+    read = sum(cumulative.get(function, 0.0) for function in PROFILE_READ_FUNCTIONS)
+    return {
+        'totale': total,
+        'lettura': read,
+        'trasformazione': max(0.0, total - write - read),
+        'scrittura': write,
+    }
+
+
+# ============================================================================
+# LOGICA DI SYNC
+# ============================================================================
+
+class WCNocODBSyncer:
+    """Orchestrator per la sincronizzazione WooCommerce ↔ NocoDB"""
+
+    def __init__(self, config: Dict, auto_rebuild: bool = True):
+        self.config = config
+        self.name = config.get('name')  # nome del negozio (solo con più negozi)
+        # False nei worker del full sync: lo stato lo inizializza il processo principale
+        self.auto_rebuild = auto_rebuild
+        self.wc = WooCommerceClient(
+            config['woocommerce']['store_url'],
+            config['woocommerce']['consumer_key'],
+            config['woocommerce']['consumer_secret'],
+            rate_limit=config['woocommerce'].get('rate_limit', WC_DEFAULT_RATE_LIMIT),
+            concurrency=config['woocommerce'].get('concurrency', 4),
+            order_fields=order_fields_projection() if config['woocommerce'].get('fields_projection', True) else None,
+            http_config=config['woocommerce'].get('http')
+        )
+        self.noco = NocODBClient(
+            config['nocodb']['api_url'],
+            config['nocodb']['api_token'],
+            batch_size=config['nocodb'].get('batch_size', 100),
+            rate_limit=config['nocodb'].get('rate_limit', NOCODB_DEFAULT_RATE_LIMIT),
+            http_config=config['nocodb'].get('http')
+        )
+
+        self.stats = {
+            'clienti_nuovi': 0,
+            'clienti_aggiornati': 0,
+            'ordini_nuovi': 0,
+            'ordini_aggiornati': 0,
+            'invariati': 0,
+            'frozen': 0,
+            'articoli_nuovi': 0,
+            'articoli_aggiornati': 0,
+            'articoli_eliminati': 0,
+            'errori': 0
+        }
+
+        self._stats_lock = threading.Lock()
+
+        # Stato locale persistente (Id NocoDB + hash dell'ultimo payload scritto)
+        self.state = StateStore(state_path(config, STATE_DB_FILE))
+
+        # Ledger degli ordini conteggiati negli aggregati clienti (Orders / Total Spend)
+        self.ledger = CustomerLedger(self.state)
+
+        # Ordini frozen: scartati prima di qualsiasi elaborazione o chiamata di rete
+        self.frozen = FrozenRegistry(state_path(config, FROZEN_FILE))
+
+        # Anagrafiche clienti raccolte dalle partizioni del full sync, scritte alla fine
+        self.pending_clienti = PendingClienti(self.state)
+
+        # Cache dei clienti WooCommerce (solo se l'arricchimento è attivo)
+        customers_config = config['woocommerce'].get('customers') or {}
+        self.customer_cache: Optional[CustomerCache] = None
+        if customers_config.get('enrich'):
+            self.customer_cache = CustomerCache(
+                self.state,
+                ttl=customers_config.get('cache_ttl', 86400),
+                max_entries=customers_config.get('cache_max_entries', 100000)
+            )
+
+        # Registrazione delle pagine WooCommerce (--record)
+        self.recorder = PageRecorder(config['record_dir']) if config.get('record_dir') else None
+
+        # Indici in memoria dei record già presenti in NocoDB (caricati una volta per run)
+        self.clienti_index: Optional[Dict[str, Dict]] = None
+        self.ordini_index: Optional[Dict[str, Dict]] = None
+
+        # Line item per ordine (solo con la tabella Order Items): Order Number → Line Item Id → record
+        self.order_items_index: Optional[Dict[str, Dict[str, Dict]]] = None
+        # Modifiche ai line item di ordini in attesa di scrittura: Order Number → modifiche
+        # (scritte da _flush_writes solo dopo l'ordine, per non lasciare line item orfani)
+        self.deferred_order_items: Dict[str, Dict[str, List]] = {}
+
+    @property
+    def order_items_enabled(self) -> bool:
+        return bool(self.config['nocodb']['table_ids'].get('order_items'))
+
+    def _load_indexes(self):
+        """
+        Carica gli indici Clienti e Ordini dallo stato locale.
+
+        Se lo stato locale è vuoto (primo avvio o file perso) viene prima
+        ricostruito da NocoDB, paginando le tabelle una sola volta (mai nei worker).
+        """
+        if self.clienti_index is None:
+            if self.auto_rebuild and self.state.count('clienti') == 0:
+                self.rebuild_state(['clienti'])
+            self.clienti_index = self.state.load_index('clienti')
+
+        if self.ordini_index is None:
+            if self.auto_rebuild and self.state.count('ordini') == 0:
+                self.rebuild_state(['ordini'])
+            self.ordini_index = self.state.load_index('ordini')
+
+        if self.order_items_index is None and self.order_items_enabled:
+            if self.auto_rebuild and self.state.count('order_items') == 0:
+                self.rebuild_state(['order_items'])
+            self.order_items_index = {}
+            for key, entry in self.state.load_index('order_items').items():
+                order_number, _, line_item_id = key.rpartition(':')
+                self.order_items_index.setdefault(order_number, {})[line_item_id] = entry
+
+    def _lookup(self, kind: str, key: str) -> Optional[Dict]:
+        """
+        Voce di una chiave dall'indice in memoria o, se manca, dallo stato locale.
+
+        Un altro processo sulla stessa state_dir (cron, --serve, --daemon) può aver
+        scritto la chiave dopo il caricamento dell'indice: senza questa verifica
+        verrebbe inserita una seconda volta.
+        """
+        index = getattr(self, f'{kind}_index')
+        entry = index.get(key)
+        if entry is None:
+            entry = self.state.get(kind, key)
+            if entry is not None:
+                index[key] = entry
+        return entry
+
+    def rebuild_state(self, kinds: List[str] = None):
+        """
+        Ricostruisce lo stato locale leggendo le tabelle NocoDB.
+
+        L'hash viene calcolato sulle colonne mappate così come sono in NocoDB:
+        dove la rappresentazione differisce da WooCommerce (es. formato date)
+        il record verrà riscritto una volta sola al primo sync.
+        """
+        table_ids = self.config['nocodb']['table_ids']
+        default_kinds = ['clienti', 'ordini'] + (['order_items'] if self.order_items_enabled else [])
+
+        for kind in kinds or default_kinds:
+            if kind == 'clienti':
+                key_field, normalize = 'Email', _normalize_email
+                columns = [c for c, _, _ in CLIENTI_MAPPING] + ['Orders', 'Total Spend']
+                if self.customer_cache is not None:
+                    columns += [c for c, _, _ in CUSTOMER_MAPPING if c not in columns]
+            elif kind == 'order_items':
+                key_field, normalize = 'Line Item Id', lambda v: str(v).strip()
+                columns = ['Order Number'] + [c for c, _, _ in ORDER_ITEMS_MAPPING]
+            else:
+                key_field, normalize = 'Order Number', lambda v: str(v).strip()
+                columns = ([c for c, _, _ in ORDINI_MAPPING] + [c for c, _, _ in LINE_ITEM_MAPPING]
+                           + sorted(set(META_MAPPING.values())))
+
+            logger.info(f"🔁 Ricostruisco lo stato locale '{kind}' da NocoDB...")
+            index = self.noco.build_index(table_ids[kind], key_field, fields=columns, normalize=normalize)
+
+            rows = []
+            for key, record in index.items():
+                data = {column: record.get(column) for column in columns}
+                data[key_field] = key
+                if kind == 'order_items':
+                    key = order_item_key(record.get('Order Number'), key)
+                rows.append((key, record['Id'], payload_hash(data), record.get('Order Status')))
+
+            self.state.replace_all(kind, rows)
+            logger.info(f"💾 Stato '{kind}': {len(rows)} record")
+
+            if kind == 'ordini':
+                self.frozen.replace(
+                    key for key, record in index.items() if record.get('Order Status') in FROZEN_STATUSES
+                )
+                logger.info(f"❄️ Registro frozen: {len(self.frozen)} ordini")
+
+            # L'indice in memoria va ricaricato dal nuovo stato
+            setattr(self, f'{kind}_index', None)
+
+    def refresh_frozen(self):
+        """Ricarica da NocoDB il registro degli ordini frozen (solo la colonna Order Number)"""
+        table_id = self.config['nocodb']['table_ids']['ordini']
+        filters = '~or'.join(f"(Order Status,eq,{status})" for status in FROZEN_STATUSES)
+
+        logger.info("❄️ Aggiorno il registro degli ordini frozen da NocoDB...")
+        self.frozen.replace(
+            record.get('Order Number')
+            for record in self.noco.iter_table_records(table_id, fields=['Order Number'], filters=filters)
+        )
+        logger.info(f"❄️ Registro frozen: {len(self.frozen)} ordini")
+
+    def _add_stat(self, key: str, amount: int = 1):
+        """Incrementa una statistica (thread-safe: il writer gira in un thread separato)"""
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _flush_writes(self, kind: str, to_create: List[Dict], to_update: List[Dict]):
+        """
+        Scrive in NocoDB le righe accumulate con richieste bulk e aggiorna statistiche e indici.
+
+        Args:
+            kind: 'clienti' o 'ordini'
+            to_create: Righe da inserire
+            to_update: Righe da aggiornare (con 'Id')
+        """
+        table_id = self.config['nocodb']['table_ids'][kind]
+        if kind == 'clienti':
+            index, key_field = self.clienti_index, 'Email'
+        else:
+            index, key_field = self.ordini_index, 'Order Number'
+
+        updated = []
+        created = []
+        failed = []
+
+        if to_update:
+            result = self.noco.bulk_update(table_id, to_update)
+            updated.extend(result['updated'])
+            created.extend(result['created'])
+            failed.extend(result['failed'])
+
+        if to_create:
+            result = self.noco.bulk_create(table_id, to_create, key_field=key_field)
+            created.extend(result['created'])
+            failed.extend(result['failed'])
+
+        self._add_stat(f'{kind}_aggiornati', len(updated))
+        self._add_stat(f'{kind}_nuovi', len(created))
+        self._add_stat('errori', len(failed))
+
+        # Registra in indice e stato locale Id e hash di quanto scritto
+        state_rows = []
+        for row, record in updated + created:
+            record_id = (record or {}).get('Id', row.get('Id'))
+            if record_id is None:
+                continue
+            entry = {'Id': record_id, 'hash': payload_hash(row)}
+            if 'Order Status' in row:
+                entry['Order Status'] = row['Order Status']
+            index[row[key_field]] = entry
+            state_rows.append((row[key_field], record_id, entry['hash'], entry.get('Order Status')))
+            if entry.get('Order Status') in FROZEN_STATUSES:
+                self.frozen.add(row[key_field])
+
+        self.state.put_many(kind, state_rows)
+
+        for row, error in failed:
+            logger.error(f"❌ Errore sincronizzando {kind} {row.get(key_field)}: {error}")
+
+        if kind == 'ordini' and self.deferred_order_items:
+            # Line item solo per gli ordini scritti; quelli degli ordini falliti vengono
+            # scartati e ricalcolati quando l'ordine viene ritentato
+            written = {key for key, _, _, _ in state_rows}
+            items = {'create': [], 'update': [], 'delete': []}
+            for row in to_create + to_update:
+                deferred = self.deferred_order_items.pop(row[key_field], None)
+                if deferred and row[key_field] in written:
+                    for action, rows in deferred.items():
+                        items[action].extend(rows)
+            if any(items.values()):
+                self._flush_order_items(items)
+
+    def _accumulate_clienti(self, wc_orders: List[Dict], clienti_da_sync: Dict[str, tuple]):
+        """
+        Registra gli ordini nel ledger e raccoglie i dati anagrafici dei clienti
+        in `clienti_da_sync` (email → (riga, customer_id, date_modified_gmt)). Vince
+        l'anagrafica dell'ordine modificato più di recente.
+        """
+        self.ledger.apply(wc_orders)
+
+        for order in wc_orders:
+            if not order.get('billing'):
+                continue
+
+            email = order['billing'].get('email', '').lower().strip()
+            if not email:
+                continue
+
+            modified = order.get('date_modified_gmt') or ''
+            if email in clienti_da_sync and clienti_da_sync[email][2] > modified:
+                continue
+
+            clienti_da_sync[email] = (
+                apply_mapping(order, CLIENTI_MAPPING),
+                order.get('customer_id') or 0,
+                modified
+            )
+
+    def _fetch_customers(self, customer_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Clienti WooCommerce per id: dalla cache locale, scaricando in blocco
+        (include=) solo quelli mancanti o scaduti.
+
+        Se /customers non risponde l'errore viene contato e si restituiscono solo
+        quelli in cache: gli altri clienti vengono scritti con i soli dati di billing.
+        """
+        ids = {int(customer_id) for customer_id in customer_ids if customer_id}
+        customers = self.customer_cache.get_many(ids)
+        missing = ids - customers.keys()
+
+        if missing:
+            try:
+                fetched = self.wc.get_customers(missing, fields=CUSTOMER_FIELDS)
+            except requests.exceptions.RequestException:
+                logger.warning(f"⚠️ Arricchimento non disponibile per {len(missing)} clienti: "
+                               f"scritti con i soli dati di billing")
+                self._add_stat('errori')
+                return customers
+            # Gli id non restituiti non esistono più: voce vuota, per non richiederli a ogni run
+            self.customer_cache.put_many({customer_id: fetched.get(customer_id, {}) for customer_id in missing})
+            customers.update(fetched)
+
+        logger.info(f"👤 Clienti WooCommerce: {len(ids) - len(missing)} dalla cache, {len(missing)} scaricati")
+        return customers
+
+    def _write_clienti(self, clienti_da_sync: Dict[str, tuple]):
+        """
+        Scrive in NocoDB i clienti con gli aggregati lifetime dal ledger, a blocchi di batch_size.
+
+        Finché il ledger non contiene tutto lo storico, Orders e Total Spend restano
+        fuori dal payload (non si sovrascrivono i valori lifetime già in NocoDB).
+        """
+        logger.info(f"📊 Trovati {len(clienti_da_sync)} clienti unici")
+
+        self._load_indexes()
+        batch_size = self.noco.batch_size
+        to_create, to_update = [], []
+        totals = self.ledger.totals(clienti_da_sync) if self.ledger.is_seeded() else None
+        now = datetime.utcnow().isoformat()
+
+        customers = {}
+        if self.customer_cache is not None:
+            customers = self._fetch_customers(customer_id for _, customer_id, _ in clienti_da_sync.values())
+
+        for email, (cliente_data, customer_id, _) in clienti_da_sync.items():
+            if customers.get(customer_id):
+                cliente_data = {**cliente_data, **apply_mapping(customers[customer_id], CUSTOMER_MAPPING)}
+
+            cliente_data = {**cliente_data, 'Last Active': now}
+            if totals is not None:
+                cliente_data['Orders'], cliente_data['Total Spend'] = totals[email]
+
+            # Cerca cliente esistente per email (indice in memoria, poi stato locale)
+            existing = self._lookup('clienti', email)
+
+            if existing:
+                # Nessuna modifica dall'ultima scrittura: nessuna chiamata
+                if existing.get('hash') == payload_hash(cliente_data):
+                    self._add_stat('invariati')
+                    continue
+
+                # UPDATE: aggiorna dati
+                to_update.append({'Id': existing['Id'], **cliente_data})
+            else:
+                # INSERT: crea nuovo
+                to_create.append(cliente_data)
+
+            if len(to_create) + len(to_update) >= batch_size:
+                self._flush_writes('clienti', to_create, to_update)
+                to_create, to_update = [], []
+
+        self._flush_writes('clienti', to_create, to_update)
+
+    def sync_clienti(self, wc_orders: List[Dict]):
+        """Sincronizza la tabella Clienti da WooCommerce"""
+        logger.info("👥 Sincronizzando clienti...")
+
+        clienti_da_sync = {}
+        self._accumulate_clienti(wc_orders, clienti_da_sync)
+        self._write_clienti(clienti_da_sync)
+
+    def _collect_ordini(self, wc_orders: List[Dict], processed_order_ids: set,
+                        to_create: List[Dict], to_update: List[Dict],
+                        emit: Callable[[List[Dict], List[Dict]], None],
+                        insert_statuses: Optional[Iterable[str]] = None,
+                        emit_items: Optional[Callable[[Dict[str, List]], None]] = None):
+        """
+        Trasforma gli ordini in righe NocoDB e decide INSERT/UPDATE dall'indice.
+
+        Le righe si accumulano in `to_create`/`to_update`; ogni volta che raggiungono
+        batch_size ne viene passata una copia a `emit` e i buffer vengono svuotati.
+        Quello che resta nei buffer alla fine è compito del chiamante.
+        Se `insert_statuses` è indicato, gli ordini nuovi con altri stati non vengono inseriti.
+        Le modifiche ai line item (tabella Order Items) degli ordini invariati vengono passate
+        a `emit_items` a fine chiamata (default: scritte subito); quelle degli ordini da
+        scrivere restano in attesa e le scrive _flush_writes dopo l'ordine.
+        """
+        batch_size = self.noco.batch_size
+        items = {'create': [], 'update': [], 'delete': []}
+        emit_items = emit_items or self._flush_order_items
+
+        for order in wc_orders:
+            try:
+                order_id = str(order.get('id'))
+                email = order['billing'].get('email', '').lower().strip()
+
+                if not email or not order_id:
+                    continue
+
+                # Skip se ordine è già stato sincronizzato (evita duplicati bundle)
+                if order_id in processed_order_ids:
+                    logger.debug(f"⏭️ Ordine {order_id} già sincronizzato (bundle child), skip")
+                    continue
+
+                processed_order_ids.add(order_id)
+
+                # Ordine frozen noto: scartato subito, senza mapping né lookup
+                if order_id in self.frozen:
+                    self._add_stat('frozen')
+                    continue
+
+                # Estrai dati ordine (mapping ai campi reali di NocoDB)
+                ordine_data = apply_mapping(order, ORDINI_MAPPING)
+
+                # Estrai nome evento dal primo prodotto
+                if order.get('line_items'):
+                    ordine_data.update(apply_mapping(order['line_items'][0], LINE_ITEM_MAPPING))
+
+                # Estrai campi custom da meta_data
+                for meta in order.get('meta_data') or []:
+                    column = META_MAPPING.get(meta.get('key', ''))
+                    if column:
+                        ordine_data[column] = meta.get('value', '')
+
+                # Cerca ordine esistente per Order Number (indice in memoria, poi stato locale)
+                existing = self._lookup('ordini', order_id)
+
+                if existing:
+                    # Se ordine è "completed" o "cancelled", non aggiornare più (frozen)
+                    if existing.get('Order Status') in FROZEN_STATUSES:
+                        logger.debug(f"❄️ Ordine {order_id} è frozen ({existing.get('Order Status')}), skip")
+                        self.frozen.add(order_id)
+                        self._add_stat('frozen')
+                        continue
+
+                    # Nessuna modifica dall'ultima scrittura: nessuna chiamata
+                    if existing.get('hash') == payload_hash(ordine_data):
+                        self._collect_order_items(order_id, order, items)
+                        self._add_stat('invariati')
+                        continue
+
+                    # UPDATE se il contenuto (tipicamente lo stato) è cambiato
+                    if existing.get('Order Status') != ordine_data['Order Status']:
+                        _log_sampler.log('cambi di stato', f"🔄 Ordine {order_id}: "
+                                         f"{existing.get('Order Status')} → {ordine_data['Order Status']}")
+                    # L'indice si aggiorna in _flush_writes, solo dopo una scrittura riuscita:
+                    # se il PATCH fallisce, il ciclo successivo (daemon/webhook) lo ritenta
+                    to_update.append({'Id': existing['Id'], **ordine_data})
+                    self._defer_order_items(order_id, order)
+                elif insert_statuses is None or order.get('status') in insert_statuses:
+                    # INSERT nuovo ordine
+                    to_create.append(ordine_data)
+                    self._defer_order_items(order_id, order)
+
+                if len(to_create) + len(to_update) >= batch_size:
+                    emit(to_create[:], to_update[:])
+                    to_create.clear()
+                    to_update.clear()
+
+            except Exception as e:
+                logger.error(f"❌ Errore sincronizzando ordine {order.get('id')}: {e}")
+                self._add_stat('errori')
+
+        if any(items.values()):
+            emit_items(items)
+
+    def _collect_order_items(self, order_id: str, order: Dict, items: Dict[str, List]):
+        """
+        Confronta i line item di un ordine con quelli già scritti in Order Items.
+
+        Accoda in `items` le righe nuove, quelle cambiate (hash diverso) e i record
+        dei line item non più presenti nell'ordine; un ordine invariato non produce nulla.
+        """
+        if self.order_items_index is None:
+            return
+
+        existing = self.order_items_index.get(order_id)
+        if existing is None:
+            # Mai visto da questo processo: i line item potrebbe averli scritti un altro
+            existing = {key.rpartition(':')[2]: entry
+                        for key, entry in self.state.load_index('order_items', prefix=f'{order_id}:').items()}
+            if existing:
+                self.order_items_index[order_id] = existing
+        seen = set()
+        for line_item in order.get('line_items') or []:
+            row = {'Order Number': order_id, **apply_mapping(line_item, ORDER_ITEMS_MAPPING)}
+            line_item_id = row['Line Item Id']
+            seen.add(line_item_id)
+
+            entry = existing.get(line_item_id)
+            if entry is None:
+                items['create'].append(row)
+            elif entry.get('hash') != payload_hash(row):
+                items['update'].append({'Id': entry['Id'], **row})
+
+        for line_item_id, entry in existing.items():
+            if line_item_id not in seen:
+                items['delete'].append((order_id, line_item_id, entry['Id']))
+
+    def _defer_order_items(self, order_id: str, order: Dict):
+        """Raccoglie le modifiche ai line item di un ordine da scrivere, rimandandole a dopo l'ordine"""
+        if self.order_items_index is None:
+            return
+        items = {'create': [], 'update': [], 'delete': []}
+        self._collect_order_items(order_id, order, items)
+        if any(items.values()):
+            self.deferred_order_items[order_id] = items
+
+    def _flush_order_items(self, items: Dict[str, List]):
+        """Scrive in Order Items le modifiche raccolte da _collect_order_items (bulk) e aggiorna indice e stato"""
+        table_id = self.config['nocodb']['table_ids']['order_items']
+        updated, created, failed = [], [], []
+
+        if items['update']:
+            result = self.noco.bulk_update(table_id, items['update'])
+            updated.extend(result['updated'])
+            created.extend(result['created'])
+            failed.extend(result['failed'])
+
+        if items['create']:
+            result = self.noco.bulk_create(table_id, items['create'], key_field='Line Item Id')
+            created.extend(result['created'])
+            failed.extend(result['failed'])
+
+        state_rows = []
+        for row, record in updated + created:
+            record_id = (record or {}).get('Id', row.get('Id'))
+            if record_id is None:
+                continue
+            entry = {'Id': record_id, 'hash': payload_hash(row)}
+            self.order_items_index.setdefault(row['Order Number'], {})[row['Line Item Id']] = entry
+            state_rows.append((order_item_key(row['Order Number'], row['Line Item Id']), record_id, entry['hash'], None))
+        self.state.put_many('order_items', state_rows)
+
+        deleted = items['delete']
+        if deleted:
+            if self.noco.bulk_delete(table_id, [record_id for _, _, record_id in deleted]) < len(deleted):
+                # Parzialmente fallito: restano nello stato e verranno ritentati al prossimo sync dell'ordine
+                self._add_stat('errori')
+                deleted = []
+            for order_number, line_item_id, _ in deleted:
+                self.order_items_index.get(order_number, {}).pop(line_item_id, None)
+            self.state.delete_many('order_items', [order_item_key(o, i) for o, i, _ in deleted])
+
+        self._add_stat('articoli_aggiornati', len(updated))
+        self._add_stat('articoli_nuovi', len(created))
+        self._add_stat('articoli_eliminati', len(deleted))
+        self._add_stat('errori', len(failed))
+
+        for row, error in failed:
+            logger.error(f"❌ Errore sincronizzando line item {row.get('Line Item Id')} "
+                         f"(ordine {row.get('Order Number')}): {error}")
+
+    def sync_ordini(self, wc_orders: List[Dict]):
+        """Sincronizza la tabella Ordini da WooCommerce"""
+        logger.info("📋 Sincronizzando ordini...")
+
+        self._load_indexes()
+        to_create, to_update = [], []
+        flush = lambda c, u: self._flush_writes('ordini', c, u)
+
+        # Traccia ordini già sincronizzati (per evitare duplicati bundle)
+        self._collect_ordini(wc_orders, set(), to_create, to_update, flush)
+        flush(to_create, to_update)
+
+    def sync_stream(self, pages: Iterator[List[Dict]],
+                    insert_statuses: Optional[Iterable[str]] = None,
+                    clienti_da_sync: Optional[Dict[str, tuple]] = None,
+                    threaded_writes: bool = True) -> Optional[str]:
+        """
+        Sincronizza un flusso di pagine di ordini con memoria limitata.
+
+        Tre stadi collegati da code limitate: download (thread in background),
+        trasformazione (thread corrente) e scrittura NocoDB (BackgroundWriter).
+        Gli ordini vengono scritti mentre si scaricano le pagine successive;
+        dei clienti si tiene solo l'aggregato, scritto alla fine.
+
+        Args:
+            pages: Iteratore di pagine di ordini (es. WooCommerceClient.iter_orders)
+            insert_statuses: Stati per cui gli ordini nuovi vengono inseriti (None = tutti)
+            clienti_da_sync: Se indicato, i clienti vengono raccolti qui e non scritti
+                (li scrive il chiamante, es. il full sync a partizioni)
+            threaded_writes: Se False, le scritture avvengono nel thread corrente (profiling)
+
+        Returns:
+            Il date_modified_gmt più recente visto (per il checkpoint), None se nessun ordine
+        """
+        queue_size = self.config.get('pipeline', {}).get('queue_size', 4)
+        if self.recorder is not None:
+            pages = self.recorder.record(pages, insert_statuses)
+
+        self._load_indexes()
+        write_clienti = clienti_da_sync is None
+        if write_clienti:
+            clienti_da_sync = {}
+        processed_order_ids = set()
+        to_create, to_update = [], []
+        last_modified = ''
+        total = 0
+
+        writer = BackgroundWriter(maxsize=queue_size, threaded=threaded_writes)
+        emit = lambda c, u: writer.submit(self._flush_writes, 'ordini', c, u)
+        emit_items = lambda items: writer.submit(self._flush_order_items, items)
+
+        try:
+            for page in iterate_in_background(pages, maxsize=queue_size):
+                total += len(page)
+                self._accumulate_clienti(page, clienti_da_sync)
+                self._collect_ordini(page, processed_order_ids, to_create, to_update, emit, insert_statuses,
+                                     emit_items)
+                last_modified = max([last_modified] + [o.get('date_modified_gmt') or '' for o in page])
+
+            if to_create or to_update:
+                emit(to_create, to_update)
+        finally:
+            writer.close()
+
+        if total == 0:
+            return None
+
+        logger.info(f"📦 Elaborati {total} ordini da WooCommerce")
+        if write_clienti:
+            logger.info("👥 Sincronizzando clienti...")
+            self._write_clienti(clienti_da_sync)
+
+        return last_modified or None
+
+    def _full_sync_journal(self) -> Dict:
+        """Riprende il journal di un full sync interrotto o ne crea uno nuovo con le partizioni"""
+        full_sync_config = self.config.get('full_sync') or {}
+
+        if full_sync_config.get('resume', True):
+            journal = load_full_sync_journal(self.config)
+            if journal:
+                done = sum(1 for partition in journal['partitions'] if partition['done'])
+                logger.info(f"⏯️ Riprendo il full sync del {journal['started_at']}: "
+                            f"{done}/{len(journal['partitions'])} partizioni già completate")
+                return journal
+
+        # Partizioni di `partition_days` giorni dal primo ordine; la prima e l'ultima
+        # sono aperte (nessun ordine resta fuori, neanche quelli creati durante il sync)
+        self.pending_clienti.clear()
+        days = full_sync_config.get('partition_days', 30)
+        first_order = self.wc.get_first_order_date(FULL_SYNC_FETCH_STATUSES)
+        journal = {'started_at': datetime.utcnow().replace(microsecond=0).isoformat(), 'partitions': []}
+
+        if first_order:
+            start = datetime.fromisoformat(first_order).replace(hour=0, minute=0, second=0, microsecond=0)
+            boundaries = []
+            boundary = start + timedelta(days=days)
+            while boundary <= datetime.utcnow():
+                boundaries.append(boundary)
+                boundary += timedelta(days=days)
+
+            edges = [None] + boundaries + [None]
+            for lower, upper in zip(edges, edges[1:]):
+                journal['partitions'].append({
+                    # `after` è esclusivo: un secondo prima del bordo
+                    'after': (lower - timedelta(seconds=1)).isoformat() if lower else None,
+                    'before': upper.isoformat() if upper else None,
+                    'done': False,
+                    'last_modified': None
+                })
+
+        save_full_sync_journal(self.config, journal)
+        logger.info(f"🧩 Full sync in {len(journal['partitions'])} partizioni da {days} giorni")
+        return journal
+
+    def sync_partition(self, partition: Dict) -> Optional[str]:
+        """
+        Sincronizza gli ordini creati nella finestra di una partizione.
+
+        Ordini e ledger vengono scritti subito; le anagrafiche clienti finiscono in
+        pending_clienti e vengono scritte quando tutte le partizioni sono complete.
+
+        Returns:
+            Il date_modified_gmt più recente visto, None se la partizione è vuota
+        """
+        logger.info(f"🧩 Partizione {partition['after'] or 'inizio'} → {partition['before'] or 'oggi'}")
+        pages = self.wc.iter_orders(
+            statuses=FULL_SYNC_FETCH_STATUSES,
+            days_back=1000,
+            created_after=partition['after'],
+            created_before=partition['before']
+        )
+
+        clienti_da_sync = {}
+        try:
+            return self.sync_stream(pages, insert_statuses=FULL_SYNC_STATUSES, clienti_da_sync=clienti_da_sync)
+        finally:
+            # Anche se la partizione fallisce: il ledger è già aggiornato per le pagine elaborate
+            self.pending_clienti.merge(clienti_da_sync)
+
+    def run_full_sync(self) -> Optional[str]:
+        """
+        Full sync a partizioni di data di creazione, riprendibile.
+
+        Ogni partizione completata senza errori viene segnata nel journal: se il
+        full sync si interrompe, il successivo riparte dalle partizioni mancanti.
+        Con `full_sync.workers` > 1 le partizioni vengono elaborate in processi
+        separati (i rate limit vengono divisi tra i worker). I clienti vengono
+        scritti una volta sola, quando tutte le partizioni sono complete.
+
+        Returns:
+            Il checkpoint per il sync incrementale (inizio del full sync), None se
+            restano partizioni da completare
+        """
+        journal = self._full_sync_journal()
+        workers = max(1, int((self.config.get('full_sync') or {}).get('workers', 1)))
+        todo = [partition for partition in journal['partitions'] if not partition['done']]
+
+        def completed(partition: Dict, last_modified: Optional[str], errors: int):
+            if errors:
+                logger.warning(f"⚠️ Partizione {partition['after']} → {partition['before']}: {errors} errori, "
+                               f"verrà ripetuta")
+                return
+            partition['done'] = True
+            partition['last_modified'] = last_modified
+            save_full_sync_journal(self.config, journal)
+
+        if workers == 1 or len(todo) <= 1:
+            for partition in todo:
+                errors_before = self.stats['errori']
+                try:
+                    last_modified = self.sync_partition(partition)
+                except Exception as e:
+                    logger.error(f"❌ Partizione {partition['after']} → {partition['before']} fallita: {e}")
+                    self._add_stat('errori')
+                    continue
+                completed(partition, last_modified, self.stats['errori'] - errors_before)
+        else:
+            # Stato locale inizializzato prima di partire (i worker non devono ricostruirlo in parallelo)
+            self._load_indexes()
+            logger.info(f"🧩 {len(todo)} partizioni su {workers} processi worker")
+
+            context = multiprocessing.get_context('spawn')
+            log_queue = context.Queue()
+            log_forwarder = QueueListener(log_queue, _ForwardToLogger())
+            log_forwarder.start()
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker_logging,
+                                         initargs=(log_queue, logging.getLogger().level)) as executor:
+                    worker_config = _split_rate_limits(self.config, workers)
+                    futures = {
+                        executor.submit(_sync_partition_worker, worker_config, partition): partition
+                        for partition in todo
+                    }
+                    for future in as_completed(futures):
+                        partition = futures[future]
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.error(f"❌ Partizione {partition['after']} → {partition['before']} fallita: {e}")
+                            self._add_stat('errori')
+                            continue
+
+                        for key, value in result['stats'].items():
+                            self._add_stat(key, value)
+                        for order_id in result['frozen']:
+                            self.frozen.add(order_id)
+                        _http_metrics.merge(result['metrics'])
+                        completed(partition, result['last_modified'], result['stats']['errori'])
+            finally:
+                log_forwarder.stop()
+
+            # I worker hanno scritto nello stato locale: indici da ricaricare
+            self.clienti_index = None
+            self.ordini_index = None
+            self.order_items_index = None
+
+        missing = sum(1 for partition in journal['partitions'] if not partition['done'])
+        if missing:
+            logger.warning(f"⚠️ {missing} partizioni da completare: rilancia --full-sync per riprendere da lì")
+        else:
+            # Tutti gli ordini sono passati dal ledger: da qui gli aggregati sono lifetime
+            self.ledger.mark_seeded()
+            clienti_da_sync = self.pending_clienti.load()
+            errors_before = self.stats['errori']
+            if clienti_da_sync:
+                logger.info("👥 Sincronizzando clienti...")
+                self._write_clienti(clienti_da_sync)
+            if self.stats['errori'] > errors_before:
+                logger.warning("⚠️ Scrittura clienti con errori: i clienti non scritti verranno aggiornati "
+                               "al loro prossimo ordine o al prossimo full sync")
+            # Partizioni tutte completate: il full sync è concluso anche se la scrittura
+            # clienti ha avuto errori (riprenderlo non rileggerebbe nessun ordine)
+            self.pending_clienti.clear()
+            save_full_sync_journal(self.config, None)
+
+        # Inizio del full sync, non il date_modified_gmt più recente visto: le partizioni
+        # girano a ore di distanza e un ordine di una partizione già completata può
+        # essere stato modificato prima del massimo visto in una partizione successiva
+        return None if missing else journal['started_at']
+
+    def reconcile(self):
+        """
+        Riconciliazione economica tra WooCommerce e NocoDB (alternativa al full sync).
+
+        Confronta una vista minima dei due lati (id/stato/data di modifica da
+        WooCommerce, Order Number/Order Status da NocoDB) in tabelle temporanee
+        SQLite, con memoria costante anche per 100k+ ordini, e scarica per intero
+        solo gli ordini mancanti in NocoDB, con stato diverso o modificati dopo
+        l'ultima registrazione nel ledger. Gli ordini spariti da WooCommerce escono
+        dal ledger; i loro record in Ordini vengono eliminati solo con
+        `reconcile.delete_orders`.
+        """
+        reconcile_config = self.config.get('reconcile') or {}
+        table_id = self.config['nocodb']['table_ids']['ordini']
+        conn, lock = self.state.conn, self.state.lock
+        self._load_indexes()
+
+        with lock:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS reconcile_noco '
+                         '(order_id INTEGER PRIMARY KEY, nocodb_id INTEGER, status TEXT)')
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS reconcile_wc '
+                         '(order_id INTEGER PRIMARY KEY, status TEXT, label TEXT, modified TEXT)')
+            conn.execute('DELETE FROM reconcile_noco')
+            conn.execute('DELETE FROM reconcile_wc')
+
+        try:
+            # Prima NocoDB e poi WooCommerce: un ordine creato nel frattempo non può risultare cancellato
+            logger.info("🔎 Riconciliazione: leggo Order Number e Order Status da NocoDB...")
+            rows = []
+            for record in self.noco.iter_table_records(table_id, fields=['Id', 'Order Number', 'Order Status']):
+                try:
+                    rows.append((int(record.get('Order Number')), record.get('Id'), record.get('Order Status')))
+                except (TypeError, ValueError):
+                    continue
+                if len(rows) >= 1000:
+                    with lock:
+                        conn.executemany('INSERT OR REPLACE INTO reconcile_noco VALUES (?, ?, ?)', rows)
+                    rows = []
+            with lock:
+                conn.executemany('INSERT OR REPLACE INTO reconcile_noco VALUES (?, ?, ?)', rows)
+
+            logger.info("🔎 Riconciliazione: leggo id, stato e data di modifica da WooCommerce...")
+            for page in self.wc.iter_orders(statuses=RECONCILE_STATUSES, days_back=1000, fields=RECONCILE_FIELDS):
+                with lock:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO reconcile_wc VALUES (?, ?, ?, ?)',
+                        [(int(order['id']), order.get('status'), order_status_label(order.get('status')),
+                          order.get('date_modified_gmt') or '') for order in page]
+                    )
+
+            with lock:
+                wc_count, noco_count = conn.execute(
+                    'SELECT (SELECT COUNT(*) FROM reconcile_wc), (SELECT COUNT(*) FROM reconcile_noco)'
+                ).fetchone()
+
+                # Da scaricare: mancanti in Ordini (se inseribili), stato diverso (non frozen),
+                # oppure modificati dopo l'ultima registrazione nel ledger (o registrati prima
+                # che il ledger salvasse la data di modifica)
+                insertable = ','.join('?' * len(FULL_SYNC_STATUSES))
+                frozen = ','.join('?' * len(FROZEN_STATUSES))
+                rows = conn.execute(
+                    f'''
+                    SELECT w.order_id, n.order_id IS NULL FROM reconcile_wc w
+                    LEFT JOIN reconcile_noco n ON n.order_id = w.order_id
+                    LEFT JOIN ledger l ON l.order_id = w.order_id
+                    WHERE (n.order_id IS NULL AND w.status IN ({insertable}))
+                       OR (n.order_id IS NOT NULL AND COALESCE(n.status, '') NOT IN ({frozen})
+                           AND n.status IS NOT w.label)
+                       OR (l.order_id IS NOT NULL AND (l.modified IS NULL OR l.modified < w.modified))
+                    ''',
+                    (*FULL_SYNC_STATUSES, *FROZEN_STATUSES)
+                ).fetchall()
+                to_fetch = [order_id for order_id, _ in rows]
+                missing = [str(order_id) for order_id, is_missing in rows if is_missing]
+
+                # Spariti da WooCommerce (cancellati o nel cestino)
+                deleted_noco = conn.execute(
+                    'SELECT n.order_id, n.nocodb_id FROM reconcile_noco n '
+                    'LEFT JOIN reconcile_wc w ON w.order_id = n.order_id WHERE w.order_id IS NULL'
+                ).fetchall()
+                deleted_ledger = [row[0] for row in conn.execute(
+                    'SELECT l.order_id FROM ledger l '
+                    'LEFT JOIN reconcile_wc w ON w.order_id = l.order_id WHERE w.order_id IS NULL'
+                )]
+        finally:
+            with lock:
+                conn.execute('DROP TABLE IF EXISTS temp.reconcile_noco')
+                conn.execute('DROP TABLE IF EXISTS temp.reconcile_wc')
+                conn.commit()
+
+        # Mai cancellare sulla base di una sola lettura: la scansione paginata può saltare
+        # un ordine (es. se uno precedente finisce nel cestino durante la lettura), quindi
+        # i "spariti" vengono richiesti di nuovo per id. Quelli che esistono ancora vengono
+        # sincronizzati per intero.
+        candidates = {order_id for order_id, _ in deleted_noco} | set(deleted_ledger)
+        if candidates:
+            present = {int(order['id']) for page in self.wc.iter_orders_by_ids(candidates, fields=['id'])
+                       for order in page}
+            if present:
+                logger.info(f"🔎 {len(present)} ordini non visti nella scansione esistono ancora in WooCommerce")
+                to_fetch.extend(sorted(present))
+                deleted_noco = [row for row in deleted_noco if row[0] not in present]
+                deleted_ledger = [order_id for order_id in deleted_ledger if order_id not in present]
+
+        logger.info(f"🔎 WooCommerce: {wc_count} ordini, NocoDB: {noco_count} ordini → "
+                    f"{len(to_fetch)} da sincronizzare, {len(deleted_noco)} spariti da WooCommerce")
+
+        # Protezione: troppi ordini "spariti" indicano una lettura incompleta, non cancellazioni reali
+        max_deleted = max(100, int(wc_count * reconcile_config.get('max_deleted_ratio', 0.05)))
+        emails_to_update = set()
+        if len(deleted_ledger) > max_deleted or len(deleted_noco) > max_deleted:
+            logger.error(f"❌ {max(len(deleted_ledger), len(deleted_noco))} ordini risultano spariti da WooCommerce "
+                         f"(limite {max_deleted}): cancellazioni ignorate, verifica la lettura degli ordini")
+            self._add_stat('errori')
+        else:
+            emails_to_update = self.ledger.remove(deleted_ledger)
+            if deleted_noco and reconcile_config.get('delete_orders', False):
+                self._delete_ordini(deleted_noco)
+            elif deleted_noco:
+                sample = ', '.join(str(order_id) for order_id, _ in deleted_noco[:10])
+                logger.warning(f"🗑️ {len(deleted_noco)} ordini in NocoDB non esistono più in WooCommerce "
+                               f"(es. {sample}): imposta reconcile.delete_orders per eliminarli")
+
+        # L'indice locale non vale più per gli ordini divergenti: mancanti ricreati, gli altri riscritti
+        self.state.delete_many('ordini', missing)
+        for key in missing:
+            self.ordini_index.pop(key, None)
+        for order_id in to_fetch:
+            entry = self.ordini_index.get(str(order_id))
+            if entry is not None:
+                entry['hash'] = None
+
+        # Ordini da sincronizzare: scaricati per intero e scritti come nel polling
+        clienti_da_sync = {}
+        if to_fetch:
+            self.sync_stream(self.wc.iter_orders_by_ids(to_fetch), insert_statuses=FULL_SYNC_STATUSES,
+                             clienti_da_sync=clienti_da_sync)
+        if clienti_da_sync:
+            logger.info("👥 Sincronizzando clienti...")
+            self._write_clienti(clienti_da_sync)
+
+        # Clienti toccati solo da ordini cancellati: aggiornati solo gli aggregati
+        if self.ledger.is_seeded():
+            self._update_clienti_totals(emails_to_update - clienti_da_sync.keys())
+
+    def _delete_ordini(self, orders: List[tuple]):
+        """Elimina da Ordini (e dallo stato locale) i record di ordini cancellati in WooCommerce"""
+        table_id = self.config['nocodb']['table_ids']['ordini']
+        record_ids = [nocodb_id for _, nocodb_id in orders if nocodb_id is not None]
+        deleted = self.noco.bulk_delete(table_id, record_ids)
+
+        if deleted < len(record_ids):
+            self._add_stat('errori', len(record_ids) - deleted)
+            return
+
+        keys = [str(order_id) for order_id, _ in orders]
+        self.state.delete_many('ordini', keys)
+        for key in keys:
+            self.ordini_index.pop(key, None)
+        self.frozen.remove(keys)
+
+        # Con la tabella Order Items vanno eliminati anche i line item degli ordini
+        if self.order_items_index is not None:
+            items = [(key, line_item_id, entry['Id'])
+                     for key in keys for line_item_id, entry in self.order_items_index.get(key, {}).items()]
+            if items:
+                self._flush_order_items({'create': [], 'update': [], 'delete': items})
+        logger.info(f"🗑️ Eliminati da NocoDB {deleted} ordini cancellati in WooCommerce")
+
+    def _update_clienti_totals(self, emails: Iterable[str]):
+        """Aggiorna solo Orders e Total Spend dei clienti indicati (es. dopo ordini cancellati)"""
+        self._load_indexes()
+        emails = [email for email in emails if self._lookup('clienti', email) is not None]
+        if not emails:
+            return
+
+        totals = self.ledger.totals(emails)
+        rows = [{'Id': self.clienti_index[email]['Id'], 'Orders': totals[email][0], 'Total Spend': totals[email][1]}
+                for email in emails]
+        table_id = self.config['nocodb']['table_ids']['clienti']
+        result = self.noco.bulk_update(table_id, rows)
+
+        self._add_stat('clienti_aggiornati', len(result['updated']))
+        self._add_stat('errori', len(result['failed']) + len(result['created']))
+
+        # Hash non più valido (scrittura parziale): il prossimo sync riscrive la riga completa
+        state_rows = []
+        for email in emails:
+            entry = self.clienti_index[email]
+            entry['hash'] = None
+            state_rows.append((email, entry['Id'], None, None))
+        self.state.put_many('clienti', state_rows)
+
+    def replay(self, directory: str, profile_path: Optional[str] = None):
+        """
+        Sincronizza le pagine registrate con --record invece di scaricarle da WooCommerce.
+
+        I file vengono letti in streaming, una pagina alla volta, e passano per lo
+        stesso sync_stream del sync normale; le scritture vanno al NocoDB configurato
+        (per il profiling conviene un NocoDB e una state_dir di prova). L'arricchimento
+        clienti è disattivato, perché richiederebbe WooCommerce.
+
+        Args:
+            directory: Cartella con i file .ndjson.gz registrati
+            profile_path: Se indicato, profila con cProfile trasformazione e scrittura
+                (eseguite nello stesso thread) e salva lì il profilo per pstats/snakeviz
+        """
+        recordings = list_recordings(directory)
+        if not recordings:
+            logger.warning(f"⚠️ Nessuna registrazione in {directory}")
+            return
+
+        logger.info(f"⏪ Replay di {len(recordings)} file da {directory}")
+        profiler = cProfile.Profile() if profile_path else None
+        customer_cache, self.customer_cache = self.customer_cache, None
+
+        try:
+            for path in recordings:
+                header, pages = open_recording(path)
+                logger.debug(f"⏪ {path.name} (registrato il {header.get('recorded_at', '?')})")
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    self.sync_stream(pages, insert_statuses=header.get('insert_statuses'),
+                                     threaded_writes=profiler is None)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            self.customer_cache = customer_cache
+
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+            stages = summarize_profile(profiler)
+            logger.info(f"🔬 Profilo salvato in {profile_path}: "
+                        + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items()))
+
+        try:
+            import resource
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            logger.info(f"🧠 Picco di memoria del processo: {peak_mb:.0f} MB")
+        except ImportError:
+            pass
+
+    def run(self, full_sync: bool = False, reconcile: bool = False,
+            replay: Optional[str] = None, profile: Optional[str] = None):
+        """
+        Esegui la sincronizzazione completa (esce con codice 1 in caso di errore critico).
+
+        Args:
+            full_sync: Se True, scarica tutti gli ordini. Se False, ultimi 7 giorni.
+            reconcile: Se True, esegue la riconciliazione invece del sync
+            replay: Cartella di pagine registrate da sincronizzare al posto di WooCommerce
+            profile: Con replay, file in cui salvare il profilo cProfile
+        """
+        if not self.run_cycle(full_sync=full_sync, reconcile=reconcile, replay=replay, profile=profile):
+            sys.exit(1)
+
+    def run_cycle(self, full_sync: bool = False, reconcile: bool = False, metrics: bool = True,
+                  replay: Optional[str] = None, profile: Optional[str] = None) -> bool:
+        """
+        Esegue un ciclo di sincronizzazione senza uscire dal processo.
+
+        Sessioni HTTP, indici e stato restano caldi tra un ciclo e l'altro;
+        le statistiche ripartono da zero.
+
+        Args:
+            metrics: Se False, metriche HTTP non azzerate né esportate (le gestisce
+                il chiamante, es. MultiStoreSyncer)
+            replay, profile: vedi run()
+
+        Returns:
+            False se il ciclo si è interrotto per un errore critico
+        """
+        self.stats = {key: 0 for key in self.stats}
+        if metrics:
+            _http_metrics.reset()
+        # Il cron o un server --serve sulla stessa state_dir possono aver congelato ordini
+        # dall'ultimo ciclo; le chiavi nuove le trova _lookup nello stato locale
+        self.frozen.reload()
+        start_time = datetime.utcnow()
+        failed = False
+        logger.info("=" * 70)
+        logger.info(f"🚀 Avviando sync WooCommerce → NocoDB{f' ({self.name})' if self.name else ''}")
+        logger.info("=" * 70)
+
+        try:
+            if reconcile:
+                # Riconciliazione: non tocca il checkpoint del sync incrementale
+                try:
+                    self.reconcile()
+                finally:
+                    self.frozen.save()
+                self._print_summary(start_time, hosts=metrics)
+                return True
+
+            if replay:
+                # Replay di pagine registrate: non tocca WooCommerce né il checkpoint
+                try:
+                    self.replay(replay, profile_path=profile)
+                finally:
+                    self.frozen.save()
+                self._print_summary(start_time, hosts=metrics)
+                return True
+
+            # Flusso di ordini da WooCommerce (+ stati chiusi, per il ledger clienti)
+            if full_sync:
+                # Full sync: tutti gli ordini, a partizioni riprendibili
+                try:
+                    new_checkpoint = last_modified = self.run_full_sync()
+                finally:
+                    self.frozen.save()
+            else:
+                if not self.ledger.is_seeded():
+                    logger.warning("⚠️ Ledger clienti non inizializzato: Orders/Total Spend non vengono scritti "
+                                   "finché non esegui una volta --full-sync")
+
+                # Incrementale: solo ordini modificati dopo l'ultimo checkpoint
+                checkpoint = load_checkpoint(self.config)
+                modified_after = None
+                if checkpoint:
+                    since = datetime.fromisoformat(checkpoint) - CHECKPOINT_OVERLAP
+                    modified_after = since.isoformat()
+                    logger.info(f"⏩ Sync incrementale da checkpoint {checkpoint}")
+                insert_statuses = INCREMENTAL_STATUSES
+                pages = self.wc.iter_orders(
+                    statuses=insert_statuses + LEDGER_STATUSES,
+                    days_back=7,
+                    modified_after=modified_after
+                )
+
+                # Sync clienti e ordini in streaming
+                try:
+                    last_modified = self.sync_stream(pages, insert_statuses=insert_statuses)
+                finally:
+                    self.frozen.save()
+                # Inizio del run, non il date_modified_gmt più recente visto: un ordine
+                # modificato mentre le pagine venivano scaricate rientra nel run successivo
+                new_checkpoint = start_time.replace(microsecond=0).isoformat()
+
+            if last_modified is None and self.stats['errori'] == 0:
+                logger.info("ℹ️ Nessun ordine da sincronizzare")
+
+            # Avanza il checkpoint solo se tutto è stato scritto (altrimenti il prossimo run riprova)
+            if self.stats['errori'] == 0:
+                if new_checkpoint:
+                    save_checkpoint(self.config, new_checkpoint)
+            else:
+                logger.warning("⚠️ Errori durante il sync: checkpoint non avanzato")
+
+            self._print_summary(start_time, hosts=metrics)
+            return True
+
+        except Exception as e:
+            failed = True
+            logger.error(f"❌ ERRORE CRITICO: {e}", exc_info=True)
+            logger.info("STATUS: ❌ ERRORE")
+            return False
+
+        finally:
+            if metrics:
+                self._export_metrics(start_time, full_sync, failed)
+
+    def _export_metrics(self, start_time: datetime, full_sync: bool, failed: bool):
+        """Scrive le metriche del ciclo: riepilogo JSON + textfile Prometheus"""
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        success = not failed and self.stats['errori'] == 0
+
+        summary = {
+            'started_at': start_time.isoformat(),
+            'duration': round(duration, 3),
+            'full_sync': full_sync,
+            'success': success,
+            'stats': dict(self.stats),
+        }
+        gauges = {
+            'sync_duration_seconds': (f'{duration:.3f}', 'Durata dell\'ultimo ciclo di sync'),
+            'sync_success': (int(success), '1 se l\'ultimo ciclo è terminato senza errori'),
+            'sync_last_run_timestamp_seconds': (int(time.time()), 'Fine dell\'ultimo ciclo (unix time)'),
+            **{f'sync_{key}': (value, f'Statistica {key} dell\'ultimo ciclo') for key, value in self.stats.items()},
+        }
+        export_metrics(self.config, summary, gauges)
+
+    def _print_summary(self, start_time: datetime, hosts: bool = True):
+        """Stampa un riepilogo della sincronizzazione (`hosts`: anche il tempo di rete per host)"""
+        duration = (datetime.utcnow() - start_time).total_seconds()
+
+        logger.info("=" * 70)
+        logger.info(f"✨ Sync completato!{f' ({self.name})' if self.name else ''}")
+        logger.info(f"👥 Clienti: {self.stats['clienti_nuovi']} nuovi, {self.stats['clienti_aggiornati']} aggiornati")
+        logger.info(f"📋 Ordini: {self.stats['ordini_nuovi']} nuovi, {self.stats['ordini_aggiornati']} aggiornati")
+        if self.order_items_enabled:
+            logger.info(f"🧾 Articoli: {self.stats['articoli_nuovi']} nuovi, {self.stats['articoli_aggiornati']} "
+                        f"aggiornati, {self.stats['articoli_eliminati']} eliminati")
+        logger.info(f"⏭️ Invariati (nessuna scrittura): {self.stats['invariati']}")
+        logger.info(f"❄️ Ordini frozen saltati: {self.stats['frozen']}")
+        logger.info(f"⏱️ Durata: {duration:.1f}s")
+
+        if hosts:
+            log_hosts_summary()
+            _log_sampler.flush()
+
+        if self.stats['errori'] > 0:
+            logger.warning(f"⚠️ Errori durante sync: {self.stats['errori']}")
+            logger.info("STATUS: ⚠️ PARTIAL")
+        else:
+            logger.info("STATUS: ✅ OK")
+
+
+def log_hosts_summary():
+    """Dove è andato il tempo: rete (per host) vs attese del nostro rate limiter"""
+    for host, totals in sorted(_http_metrics.summary()['hosts'].items()):
+        logger.info(f"🌐 {host}: {totals['requests']} richieste, {totals['latency_sum']:.1f}s in rete, "
+                    f"{totals['rate_limit_wait']:.1f}s in attesa rate limit, {totals['throttled']} risposte 429")
+
+
+def _split_rate_limits(config: Dict, workers: int) -> Dict:
+    """Copia della config con i rate limit divisi tra i worker (il limite vale per host, non per processo)"""
+    worker_config = json.loads(json.dumps(config))
+    for service, default in (('woocommerce', WC_DEFAULT_RATE_LIMIT), ('nocodb', NOCODB_DEFAULT_RATE_LIMIT)):
+        rate_limit = {**default, **(worker_config[service].get('rate_limit') or {})}
+        rate_limit['requests_per_second'] = float(rate_limit['requests_per_second']) / workers
+        rate_limit['burst'] = max(1, int(rate_limit['burst']) // workers)
+        worker_config[service]['rate_limit'] = rate_limit
+    return worker_config
+
+
+def _sync_partition_worker(config: Dict, partition: Dict) -> Dict:
+    """Eseguito in un processo worker del full sync: sincronizza una partizione"""
+    _http_metrics.reset()
+    syncer = WCNocODBSyncer(config, auto_rebuild=False)
+    try:
+        last_modified = syncer.sync_partition(partition)
+        return {
+            'last_modified': last_modified,
+            'stats': dict(syncer.stats),
+            'frozen': sorted(syncer.frozen.pending),  # il registro su disco lo aggiorna il processo principale
+            'metrics': _http_metrics.snapshot(),
+        }
+    finally:
+        syncer.state.close()
+        _log_sampler.flush()
 
 
 # ============================================================================
-# NOCODB CLIENT
+# PIÙ NEGOZI
 # ============================================================================
 
-class NocODBClient:
-    """Client per interagire con NocoDB API v2"""
+class MultiStoreSyncer:
+    """
+    Sincronizza più negozi WooCommerce in un solo processo (chiave "stores" della config).
 
-    def __init__(self, base_url: str, token: str):
-        self.base_url = base_url.rstrip('/')
-        self.token = token
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        })
+    Ogni negozio ha il suo WCNocODBSyncer (tabelle, stato locale, checkpoint) e i
+    cicli girano in parallelo, uno per thread. Rate limiter e pool di connessioni
+    sono per host e quindi condivisi: i negozi che scrivono sulla stessa istanza
+    NocoDB si dividono il suo budget, servito in ordine di arrivo. Riepilogo e
+    metriche sono unici per tutto il processo.
 
-    def _request(self, method: str, endpoint: str, **kwargs) -> Dict:
-        """Helper per fare richieste autenticate"""
-        url = f"{self.base_url}{endpoint}"
+    Espone la stessa interfaccia di WCNocODBSyncer usata da main e SyncDaemon.
+    """
 
-        try:
-            response = self.session.request(method, url, timeout=10, **kwargs)
+    def __init__(self, config: Dict, stores: List[Dict]):
+        self.config = config
+        self.syncers = [WCNocODBSyncer(store) for store in stores]
 
-            if response.status_code == 401:
-                raise ValueError("Token NocoDB non valido o scaduto")
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Statistiche dell'ultimo ciclo sommate su tutti i negozi"""
+        totals = {}
+        for syncer in self.syncers:
+            for key, value in syncer.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
 
-            response.raise_for_status()
-            return response.json() if response.text else {}
+    def run(self, full_sync: bool = False, reconcile: bool = False, replay: Optional[str] = None):
+        """Esegue un ciclo su tutti i negozi (esce con codice 1 se almeno uno fallisce)"""
+        if not self.run_cycle(full_sync=full_sync, reconcile=reconcile, replay=replay):
+            sys.exit(1)
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ Errore NocoDB ({method} {endpoint}): {e}")
-            raise
+    def run_cycle(self, full_sync: bool = False, reconcile: bool = False, replay: Optional[str] = None) -> bool:
+        """
+        Un ciclo per negozio, in parallelo; False se almeno un negozio ha avuto un errore critico.
 
-    def get_table_records(self, table_id: str, filters: str = None, limit: int = 1000) -> List[Dict]:
+        Con `replay`, ogni negozio rilegge le proprie registrazioni da `replay/<name>`.
         """
-        Recupera record da una tabella NocoDB.
+        _http_metrics.reset()
+        start_time = datetime.utcnow()
 
-        Args:
-            table_id: ID della tabella
-            filters: Query filter in formato NocoDB
-            limit: Numero massimo di record
+        with ThreadPoolExecutor(max_workers=len(self.syncers), thread_name_prefix='store') as executor:
+            results = list(executor.map(
+                lambda syncer: syncer.run_cycle(
+                    full_sync=full_sync, reconcile=reconcile, metrics=False,
+                    replay=os.path.join(replay, store_dir_name(syncer.name)) if replay else None
+                ),
+                self.syncers
+            ))
 
-        Returns:
-            Lista di record
-        """
-        params = {'limit': limit}
-        if filters:
-            params['where'] = filters
+        self._print_summary(start_time, results)
+        self._export_metrics(start_time, full_sync, results)
+        return all(results)
 
-        try:
-            result = self._request('GET', f'/tables/{table_id}/records', params=params)
-            return result.get('list', [])
-        except Exception as e:
-            logger.warning(f"⚠️ Errore nel recupero record da {table_id}: {e}")
-            return []
+    def _print_summary(self, start_time: datetime, results: List[bool]):
+        """Riepilogo complessivo: una riga per negozio, totali e tempo di rete per host"""
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        stats = self.stats
 
-    def create_record(self, table_id: str, data: Dict) -> Optional[Dict]:
-        """Crea un nuovo record in NocoDB"""
-        try:
-            result = self._request('POST', f'/tables/{table_id}/records', json=data)
-            logger.debug(f"✅ Record creato in {table_id}: {result.get('Id', 'N/A')}")
-            return result
-        except Exception as e:
-            logger.error(f"❌ Errore creando record in {table_id}: {e}")
-            return None
+        logger.info("=" * 70)
+        logger.info(f"✨ Sync di {len(self.syncers)} negozi completato!")
+        for syncer, ok in zip(self.syncers, results):
+            logger.info(f"🏪 {syncer.name}: {syncer.stats['ordini_nuovi']} ordini nuovi, "
+                        f"{syncer.stats['ordini_aggiornati']} aggiornati, {syncer.stats['clienti_nuovi']} clienti nuovi, "
+                        f"{syncer.stats['clienti_aggiornati']} aggiornati, {syncer.stats['errori']} errori"
+                        f"{'' if ok else ' ❌'}")
+        logger.info(f"👥 Clienti: {stats['clienti_nuovi']} nuovi, {stats['clienti_aggiornati']} aggiornati")
+        logger.info(f"📋 Ordini: {stats['ordini_nuovi']} nuovi, {stats['ordini_aggiornati']} aggiornati")
+        logger.info(f"⏱️ Durata: {duration:.1f}s")
+        log_hosts_summary()
+        _log_sampler.flush()
 
-    def update_record(self, table_id: str, record_id: str, data: Dict) -> Optional[Dict]:
-        """Aggiorna un record in NocoDB con fallback a INSERT se record non esiste"""
-        try:
-            result = self._request('PATCH', f'/tables/{table_id}/records/{record_id}', json=data)
-            logger.debug(f"✅ Record {record_id} aggiornato in {table_id}")
-            return result
-        except requests.exceptions.HTTPError as e:
-            # Se il record non esiste (404), prova a crearlo (INSERT fallback)
-            if e.response.status_code == 404:
-                logger.warning(f"⚠️ Record {record_id} non trovato (404), fallback a INSERT...")
-                return self.create_record(table_id, data)
-            # Per altri errori HTTP, log e ritorna None
-            logger.error(f"❌ Errore aggiornando record {record_id} in {table_id}: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"❌ Errore aggiornando record {record_id} in {table_id}: {e}")
-            return None
+        if not all(results):
+            logger.info("STATUS: ❌ ERRORE")
+        elif stats['errori'] > 0:
+            logger.warning(f"⚠️ Errori durante sync: {stats['errori']}")
+            logger.info("STATUS: ⚠️ PARTIAL")
+        else:
+            logger.info("STATUS: ✅ OK")
 
-    def get_record_by_email(self, table_id: str, email: str) -> Optional[Dict]:
-        """Trova un record cliente per email"""
-        try:
-            records = self.get_table_records(table_id, filters=f"(Email,eq,{email})")
-            return records[0] if records else None
-        except Exception as e:
-            logger.warning(f"⚠️ Errore cercando cliente con email {email}: {e}")
-            return None
+    def _export_metrics(self, start_time: datetime, full_sync: bool, results: List[bool]):
+        """Metriche complessive: le statistiche hanno una serie per negozio (label `store`)"""
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        success = {syncer.name: ok and syncer.stats['errori'] == 0 for syncer, ok in zip(self.syncers, results)}
 
-    def get_record_by_field(self, table_id: str, field: str, value: Any) -> Optional[Dict]:
-        """Trova un record per un campo specifico"""
-        try:
-            records = self.get_table_records(table_id, filters=f"({field},eq,{value})")
-            if records:
-                record = records[0]
-                logger.debug(f"🔍 Trovato record per {field}={value}: ID={record.get('Id', 'N/A')}")
-                return record
-            else:
-                logger.debug(f"🔍 Nessun record trovato per {field}={value}")
-                return None
-        except Exception as e:
-            logger.warning(f"⚠️ Errore cercando {field}={value} in {table_id}: {e}")
-            return None
+        summary = {
+            'started_at': start_time.isoformat(),
+            'duration': round(duration, 3),
+            'full_sync': full_sync,
+            'success': all(success.values()),
+            'stats': self.stats,
+            'stores': {syncer.name: {'success': success[syncer.name], 'stats': dict(syncer.stats)}
+                       for syncer in self.syncers},
+        }
+        gauges = {
+            'sync_duration_seconds': (f'{duration:.3f}', 'Durata dell\'ultimo ciclo di sync'),
+            'sync_success': ({name: int(ok) for name, ok in success.items()},
+                             '1 se l\'ultimo ciclo è terminato senza errori'),
+            'sync_last_run_timestamp_seconds': (int(time.time()), 'Fine dell\'ultimo ciclo (unix time)'),
+            **{f'sync_{key}': ({syncer.name: syncer.stats[key] for syncer in self.syncers},
+                               f'Statistica {key} dell\'ultimo ciclo') for key in self.stats},
+        }
+        export_metrics(self.config, summary, gauges)
+
+    def rebuild_state(self):
+        for syncer in self.syncers:
+            syncer.rebuild_state()
+
+    def refresh_frozen(self):
+        for syncer in self.syncers:
+            syncer.refresh_frozen()
 
 
 # ============================================================================
-# LOGICA DI SYNC
+# DAEMON
 # ============================================================================
 
-class WCNocODBSyncer:
-    """Orchestrator per la sincronizzazione WooCommerce ↔ NocoDB"""
+class SyncDaemon:
+    """
+    Esegue il sync a intervalli regolari in un unico processo.
 
-    def __init__(self, config: Dict):
-        self.config = config
-        self.wc = WooCommerceClient(
-            config['woocommerce']['store_url'],
-            config['woocommerce']['consumer_key'],
-            config['woocommerce']['consumer_secret']
-        )
-        self.noco = NocODBClient(
-            config['nocodb']['api_url'],
-            config['nocodb']['api_token']
-        )
+    Un solo WCNocODBSyncer viene riusato per tutti i cicli: connessioni HTTP,
+    indici in memoria e stato locale restano caldi. I cicli sono sequenziali
+    (mai sovrapposti); il full sync giornaliero è un job separato che prende
+    il posto del ciclo incrementale all'orario indicato. SIGTERM/SIGINT fanno
+    terminare il ciclo in corso e poi uscire.
+    """
 
-        self.stats = {
-            'clienti_nuovi': 0,
-            'clienti_aggiornati': 0,
-            'ordini_nuovi': 0,
-            'ordini_aggiornati': 0,
-            'errori': 0
-        }
+    DAILY_JOBS = ('reconcile', 'full_sync')
 
-    def sync_clienti(self, wc_orders: List[Dict]):
-        """Sincronizza la tabella Clienti da WooCommerce"""
-        logger.info("👥 Sincronizzando clienti...")
+    def __init__(self, syncer: 'WCNocODBSyncer', daemon_config: Dict):
+        self.syncer = syncer  # oppure MultiStoreSyncer
+        self.interval = float(daemon_config.get('interval', 300))
+        self.full_sync_at = daemon_config.get('full_sync_at', '03:00')  # HH:MM ora locale, None = mai
+        self.daily_job = daemon_config.get('daily_job', 'reconcile')  # riconciliazione o full sync
+        if self.daily_job not in self.DAILY_JOBS:
+            raise ValueError(f"daemon.daily_job deve essere uno di {', '.join(self.DAILY_JOBS)}")
+        self.stopping = threading.Event()
 
-        clienti_da_sync = {}
+    def _next_full_sync(self, after: datetime) -> Optional[datetime]:
+        if not self.full_sync_at:
+            return None
+        hour, minute = (int(part) for part in self.full_sync_at.split(':'))
+        candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate <= after:
+            candidate += timedelta(days=1)
+        return candidate
 
-        # Estrai dati clienti dagli ordini
-        for order in wc_orders:
-            if not order.get('billing'):
-                continue
+    def stop(self, signum=None, frame=None):
+        if not self.stopping.is_set():
+            logger.info("🛑 Arresto richiesto: termino il ciclo in corso e poi esco")
+        self.stopping.set()
 
-            email = order['billing'].get('email', '').lower().strip()
-            if not email:
-                continue
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
 
-            # Aggregazione intelligente per cliente
-            if email not in clienti_da_sync:
-                first_name = order['billing'].get('first_name', '')
-                last_name = order['billing'].get('last_name', '')
-                name = f"{first_name} {last_name}".strip()
-
-                clienti_da_sync[email] = {
-                    'Email': email,
-                    'Name': name,
-                    'Username': email,
-                    'Phone (Billing)': order['billing'].get('phone', ''),
-                    'Country / Region': order['billing'].get('country', ''),
-                    'City': order['billing'].get('city', ''),
-                    'Postal Code': order['billing'].get('postcode', ''),
-                    'Orders': 0,
-                    'Total Spend': 0.0,
-                    'Last Active': datetime.utcnow().isoformat()
-                }
-
-            # Aggregazione
-            clienti_da_sync[email]['Orders'] = clienti_da_sync[email].get('Orders', 0) + 1
-            clienti_da_sync[email]['Total Spend'] = clienti_da_sync[email].get('Total Spend', 0.0) + float(order.get('total', 0))
+        next_full_sync = self._next_full_sync(datetime.now())
+        job_name = 'riconciliazione' if self.daily_job == 'reconcile' else 'full sync'
+        logger.info(f"🔁 Daemon avviato: sync ogni {self.interval:.0f}s"
+                    + (f", {job_name} alle {self.full_sync_at}" if next_full_sync else ""))
 
-        logger.info(f"📊 Trovati {len(clienti_da_sync)} clienti unici")
+        while not self.stopping.is_set():
+            cycle_start = time.monotonic()
 
-        # Sync in NocoDB
-        table_id = self.config['nocodb']['table_ids']['clienti']
+            daily = next_full_sync is not None and datetime.now() >= next_full_sync
+            if daily:
+                logger.info(f"📅 Job giornaliero: {job_name}")
 
-        for email, cliente_data in clienti_da_sync.items():
-            try:
-                # Cerca cliente esistente per email
-                existing = self.noco.get_record_by_email(table_id, email)
-                time.sleep(1.0)  # Rate limiting per NocoDB (200ms)
+            ok = self.syncer.run_cycle(
+                full_sync=daily and self.daily_job == 'full_sync',
+                reconcile=daily and self.daily_job == 'reconcile'
+            )
+            if not ok:
+                logger.warning("⚠️ Ciclo fallito, riprovo al prossimo intervallo")
+            elif daily:
+                next_full_sync = self._next_full_sync(datetime.now())
 
-                if existing:
-                    # UPDATE: aggiorna dati
-                    self.noco.update_record(table_id, existing['Id'], cliente_data)
-                    self.stats['clienti_aggiornati'] += 1
-                else:
-                    # INSERT: crea nuovo
-                    self.noco.create_record(table_id, cliente_data)
-                    self.stats['clienti_nuovi'] += 1
+            # Attesa interrompibile fino al prossimo ciclo (nessuna sovrapposizione)
+            elapsed = time.monotonic() - cycle_start
+            self.stopping.wait(max(0.0, self.interval - elapsed))
 
-                time.sleep(1.0)  # Rate limiting per NocoDB (200ms)
+        logger.info("👋 Daemon fermato")
 
-            except Exception as e:
-                logger.error(f"❌ Errore sincronizzando cliente {email}: {e}")
-                self.stats['errori'] += 1
 
-    def sync_ordini(self, wc_orders: List[Dict]):
-        """Sincronizza la tabella Ordini da WooCommerce"""
-        logger.info("📋 Sincronizzando ordini...")
+# ============================================================================
+# WEBHOOK
+# ============================================================================
 
-        table_id = self.config['nocodb']['table_ids']['ordini']
-        clienti_table_id = self.config['nocodb']['table_ids']['clienti']
+WEBHOOK_TOPICS = {'order.created', 'order.updated'}
 
-        # Traccia ordini già sincronizzati (per evitare duplicati bundle)
-        processed_order_ids = set()
 
-        for order in wc_orders:
-            try:
-                order_id = str(order.get('id'))
-                email = order['billing'].get('email', '').lower().strip()
+def verify_webhook_signature(body: bytes, signature: Optional[str], secret: str) -> bool:
+    """Verifica X-WC-Webhook-Signature (base64 dell'HMAC-SHA256 del body)"""
+    expected = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(expected, signature or '')
 
-                if not email or not order_id:
-                    continue
 
-                # Skip se ordine è già stato sincronizzato (evita duplicati bundle)
-                if order_id in processed_order_ids:
-                    logger.debug(f"⏭️ Ordine {order_id} già sincronizzato (bundle child), skip")
-                    continue
+class WebhookBuffer:
+    """
+    Ordini ricevuti via webhook in attesa di scrittura.
 
-                processed_order_ids.add(order_id)
+    Più eventi per lo stesso ordine vengono fusi tenendo la versione con
+    date_modified più recente. `take` restituisce un micro-batch appena si
+    raggiungono `max_batch` ordini oppure allo scadere del timeout.
+    """
 
-                # Estrai dati ordine (mapping ai campi reali di NocoDB)
-                ordine_data = {
-                    'Order Number': order_id,
-                    'Order Status': order.get('status', 'pending').capitalize(),
-                    'Order Date': order.get('date_created', ''),
-                    'Order Total Amount': float(order.get('total', 0)),
-                    'Payment Method Title': order.get('payment_method_title', ''),
-                    'Customer Note': order.get('customer_note', ''),
-                    'Email (Billing)': email,
-                    'First Name (Billing)': order['billing'].get('first_name', ''),
-                    'Last Name (Billing)': order['billing'].get('last_name', ''),
-                    'Phone (Billing)': order['billing'].get('phone', ''),
-                    'Country Code (Billing)': order['billing'].get('country', ''),
-                    'City (Billing)': order['billing'].get('city', ''),
-                    'Address 1&2 (Billing)': order['billing'].get('address_1', ''),
-                    'Postcode (Billing)': order['billing'].get('postcode', '')
-                }
+    def __init__(self, max_batch: int = 100):
+        self.max_batch = max_batch
+        self.orders: Dict[Any, Dict] = {}
+        self.cond = threading.Condition()
 
-                # Estrai nome evento dal primo prodotto
-                if order.get('line_items'):
-                    ordine_data['Item Name'] = order['line_items'][0].get('name', '')
-                    ordine_data['Quantity (- Refund)'] = order['line_items'][0].get('quantity', 1)
-                    ordine_data['Item Cost'] = float(order['line_items'][0].get('total', 0))
+    def add(self, order: Dict):
+        with self.cond:
+            current = self.orders.get(order['id'])
+            if current is None or (order.get('date_modified_gmt') or '') >= (current.get('date_modified_gmt') or ''):
+                self.orders[order['id']] = order
+            if len(self.orders) >= self.max_batch:
+                self.cond.notify()
 
-                # Estrai campi custom da meta_data
-                if order.get('meta_data'):
-                    for meta in order['meta_data']:
-                        key = meta.get('key', '')
-                        value = meta.get('value', '')
-                        # Mappa i campi custom
-                        if key == 'percorso':
-                            ordine_data['percorso'] = value
-                        elif key == '_data_partenza' or key == 'data_partenza':
-                            ordine_data['data partenza'] = value
-
-                # Cerca ordine esistente per Order Number
-                existing = self.noco.get_record_by_field(table_id, 'Order Number', order_id)
-                time.sleep(1.0)  # Rate limiting per NocoDB (200ms)
+    def take(self, timeout: float) -> List[Dict]:
+        with self.cond:
+            if len(self.orders) < self.max_batch:
+                self.cond.wait(timeout)
+            orders = list(self.orders.values())
+            self.orders = {}
+        return orders
 
-                if existing:
-                    # Se ordine è "completed" o "cancelled", non aggiornare più (frozen)
-                    if existing.get('Order Status') in ['Completed', 'Cancelled']:
-                        logger.info(f"❄️ Ordine {order_id} è frozen ({existing.get('Order Status')}), skip")
-                        continue
+    def wake(self):
+        with self.cond:
+            self.cond.notify()
 
-                    # UPDATE se lo stato è cambiato
-                    if existing.get('Order Status') != ordine_data['Order Status']:
-                        self.noco.update_record(table_id, existing['Id'], ordine_data)
-                        self.stats['ordini_aggiornati'] += 1
-                        logger.info(f"🔄 Ordine {order_id}: {existing.get('Order Status')} → {ordine_data['Order Status']}")
-                        time.sleep(1.0)  # Rate limiting per NocoDB (200ms)
-                else:
-                    # INSERT nuovo ordine
-                    self.noco.create_record(table_id, ordine_data)
-                    self.stats['ordini_nuovi'] += 1
-                    time.sleep(1.0)  # Rate limiting per NocoDB (200ms)
 
-            except Exception as e:
-                logger.error(f"❌ Errore sincronizzando ordine {order.get('id')}: {e}")
-                self.stats['errori'] += 1
+class WebhookServer:
+    """
+    Server HTTP locale che riceve i webhook WooCommerce `order.created` / `order.updated`.
 
-    def run(self, full_sync: bool = False):
-        """
-        Esegui la sincronizzazione completa.
+    Gli eventi con firma valida finiscono in un WebhookBuffer; un thread li scrive
+    su NocoDB a micro-batch riusando la stessa pipeline del polling (ledger,
+    clienti, ordini). Il polling resta come riconciliazione di sicurezza.
+    """
 
-        Args:
-            full_sync: Se True, scarica tutti gli ordini. Se False, ultimi 7 giorni.
-        """
-        start_time = datetime.utcnow()
-        logger.info("=" * 70)
-        logger.info("🚀 Avviando sync WooCommerce → NocoDB")
-        logger.info("=" * 70)
+    def __init__(self, syncer: 'WCNocODBSyncer', webhook_config: Dict):
+        self.syncer = syncer
+        self.secret = webhook_config['secret']
+        self.host = webhook_config.get('host', '127.0.0.1')
+        self.port = int(webhook_config.get('port', 8787))
+        self.flush_interval = float(webhook_config.get('flush_interval', 5))
+        self.buffer = WebhookBuffer(max_batch=webhook_config.get('batch_size', syncer.noco.batch_size))
+        self.stopping = threading.Event()
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
 
-        try:
-            # Logica intelligente: full sync una volta al giorno
-            days_back = 1000 if full_sync else 7
+    def _make_handler(self):
+        server = self
 
-            # Recupera ordini da WooCommerce
-            wc_orders = self.wc.get_orders(days_back=days_back)
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                topic = self.headers.get('X-WC-Webhook-Topic')
 
-            if not wc_orders:
-                logger.info("ℹ️ Nessun ordine da sincronizzare")
-                return self._print_summary(start_time)
+                # Ping di WooCommerce alla creazione del webhook (non firmato, senza topic)
+                if topic is None and body.startswith(b'webhook_id='):
+                    return self._reply(200)
 
-            logger.info(f"📦 Trovati {len(wc_orders)} ordini processing da WooCommerce")
+                if not verify_webhook_signature(body, self.headers.get('X-WC-Webhook-Signature'), server.secret):
+                    logger.warning(f"🚫 Webhook con firma non valida da {self.client_address[0]}")
+                    return self._reply(401)
 
-            # Sync clienti e ordini
-            self.sync_clienti(wc_orders)
-            self.sync_ordini(wc_orders)
+                if topic not in WEBHOOK_TOPICS:
+                    logger.debug(f"⏭️ Webhook {topic} ignorato")
+                    return self._reply(200)
 
-            self._print_summary(start_time)
+                try:
+                    order = json.loads(body)
+                    order['id']
+                except (ValueError, KeyError, TypeError):
+                    return self._reply(400)
 
+                server.buffer.add(order)
+                logger.debug(f"📥 Webhook {topic} per ordine {order['id']}")
+                self._reply(202)
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"🌐 {self.address_string()} {format % args}")
+
+        return WebhookHandler
+
+    def _flush_loop(self):
+        while not self.stopping.is_set():
+            self._flush(self.buffer.take(self.flush_interval))
+        # Ultimo flush di quanto arrivato prima dello stop
+        self._flush(self.buffer.take(0))
+
+    def _flush(self, orders: List[Dict]):
+        if not orders:
+            return
+
+        logger.info(f"📤 Scrivo {len(orders)} ordini ricevuti via webhook")
+        try:
+            self.syncer.sync_stream(iter([orders]), insert_statuses=FULL_SYNC_STATUSES)
+            self.syncer.frozen.save()
         except Exception as e:
-            logger.error(f"❌ ERRORE CRITICO: {e}", exc_info=True)
-            logger.info("STATUS: ❌ ERRORE")
-            sys.exit(1)
+            # Rimette in coda: verranno ritentati al prossimo flush (senza sovrascrivere versioni più nuove)
+            logger.error(f"❌ Errore scrivendo batch webhook: {e}", exc_info=True)
+            for order in orders:
+                self.buffer.add(order)
 
-    def _print_summary(self, start_time: datetime):
-        """Stampa un riepilogo della sincronizzazione"""
-        duration = (datetime.utcnow() - start_time).total_seconds()
+    def stop(self, *_):
+        """Ferma il server (sicuro da chiamare da un signal handler)"""
+        self.stopping.set()
+        self.buffer.wake()
+        threading.Thread(target=self.httpd.shutdown, daemon=True).start()
 
-        logger.info("=" * 70)
-        logger.info("✨ Sync completato!")
-        logger.info(f"👥 Clienti: {self.stats['clienti_nuovi']} nuovi, {self.stats['clienti_aggiornati']} aggiornati")
-        logger.info(f"📋 Ordini: {self.stats['ordini_nuovi']} nuovi, {self.stats['ordini_aggiornati']} aggiornati")
-        logger.info(f"⏱️ Durata: {duration:.1f}s")
+    def serve_forever(self):
+        flusher = threading.Thread(target=self._flush_loop, name='webhook-flush', daemon=True)
+        flusher.start()
 
-        if self.stats['errori'] > 0:
-            logger.warning(f"⚠️ Errori durante sync: {self.stats['errori']}")
-            logger.info("STATUS: ⚠️ PARTIAL")
-        else:
-            logger.info("STATUS: ✅ OK")
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info(f"👂 In ascolto per webhook WooCommerce su http://{self.host}:{self.port}/")
+
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            self.stop()
+        finally:
+            self.stopping.set()
+            self.buffer.wake()
+            flusher.join()
+            self.httpd.server_close()
+            logger.info("👋 Server webhook fermato")
 
 
 # ============================================================================
@@ -485,11 +3864,12 @@ def load_config(config_path: str = None) -> Dict:
     if not config_path:
         config_path = os.path.expanduser('~/.wc-nocodb-sync.json')
 
-    # Prova a caricare da file
+    # Prova a caricare da file (una lista equivale a {"stores": [...]})
     if os.path.exists(config_path):
         try:
             with open(config_path) as f:
-                return json.load(f)
+                config = json.load(f)
+            return {'stores': config} if isinstance(config, list) else config
         except Exception as e:
             logger.error(f"❌ Errore caricando config da {config_path}: {e}")
 
@@ -507,12 +3887,65 @@ def load_config(config_path: str = None) -> Dict:
             'api_token': os.getenv('NOCODB_API_TOKEN'),
             'table_ids': {
                 'clienti': os.getenv('NOCODB_TABLE_CLIENTI'),
-                'ordini': os.getenv('NOCODB_TABLE_ORDINI')
+                'ordini': os.getenv('NOCODB_TABLE_ORDINI'),
+                'order_items': os.getenv('NOCODB_TABLE_ORDER_ITEMS')
             }
+        },
+        'webhook': {
+            'secret': os.getenv('WC_WEBHOOK_SECRET'),
+            'port': int(os.getenv('WC_WEBHOOK_PORT', '8787'))
         }
     }
 
 
+def _merge_config(base: Dict, override: Dict) -> Dict:
+    """Unisce due configurazioni: le sezioni annidate vengono fuse, il resto sovrascritto"""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def store_dir_name(name: str) -> str:
+    """Nome di cartella per un negozio (state_dir e registrazioni per negozio)"""
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def store_configs(config: Dict) -> List[Dict]:
+    """
+    Configurazioni dei singoli negozi.
+
+    Senza "stores" è un solo negozio (la config stessa). Con "stores" ogni voce
+    viene fusa sulle sezioni comuni (es. nocodb, full_sync), riceve un `name`
+    (default: host dello store) e, se non indicata, una `state_dir` propria
+    sotto quella comune.
+    """
+    if not config.get('stores'):
+        return [config]
+
+    base = {key: value for key, value in config.items() if key != 'stores'}
+    base_state_dir = config.get('state_dir', DEFAULT_STATE_DIR)
+    stores = []
+
+    for store in config['stores']:
+        store_config = _merge_config(base, store)
+        name = store.get('name') or urlparse(store_config['woocommerce'].get('store_url') or '').netloc
+        store_config['name'] = name
+        if 'state_dir' not in store:
+            store_config['state_dir'] = os.path.join(base_state_dir, store_dir_name(name))
+        stores.append(store_config)
+
+    for key in ('name', 'state_dir'):
+        values = [store[key] for store in stores]
+        if len(set(values)) != len(values):
+            raise ValueError(f"stores: '{key}' deve essere diverso per ogni negozio")
+
+    return stores
+
+
 def main():
     """Punto di ingresso principale"""
     import argparse
@@ -530,20 +3963,88 @@ def main():
         action='store_true',
         help='Scarica tutti gli ordini (invece di ultimi 7 giorni)'
     )
+    parser.add_argument(
+        '--reconcile',
+        action='store_true',
+        help='Confronta WooCommerce e NocoDB (solo id/stato) e sincronizza solo gli ordini divergenti'
+    )
+    parser.add_argument(
+        '--restart-full-sync',
+        action='store_true',
+        help='Con --full-sync: ignora il journal di un full sync interrotto e riparte da zero'
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Resta in esecuzione e sincronizza a intervalli (sezione "daemon" della config)'
+    )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        help='Avvia il server che riceve i webhook WooCommerce (order.created/updated)'
+    )
+    parser.add_argument(
+        '--rebuild-state',
+        action='store_true',
+        help='Ricostruisce lo stato locale (Id e hash dei record) leggendo NocoDB, poi esce'
+    )
+    parser.add_argument(
+        '--refresh-frozen',
+        action='store_true',
+        help='Ricarica da NocoDB il registro degli ordini frozen (Completed/Cancelled), poi esce'
+    )
+    parser.add_argument(
+        '--record',
+        metavar='DIR',
+        help='Registra le pagine di ordini ricevute da WooCommerce (NDJSON compresso) in DIR'
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='DIR',
+        help='Sincronizza le pagine registrate con --record invece di interrogare WooCommerce'
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help='Con --replay: profila trasformazione e scrittura con cProfile e salva il profilo in FILE'
+    )
+    parser.add_argument(
+        '--no-fields-projection',
+        action='store_true',
+        help='Scarica gli ordini completi invece dei soli campi usati (_fields), utile per debug'
+    )
     parser.add_argument(
         '--log-level',
         default='INFO',
         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
         help='Livello di logging'
     )
+    parser.add_argument(
+        '--log-format',
+        choices=['text', 'json'],
+        help='Formato dei log (default: logging.format della config, altrimenti text)'
+    )
 
     args = parser.parse_args()
 
-    # Configura logging
-    logging.getLogger().setLevel(getattr(logging, args.log_level))
+    # Configura logging (default finché la config non è caricata)
+    level = getattr(logging, args.log_level)
+    cli_logging = {'format': args.log_format} if args.log_format else {}
+    setup_logging(cli_logging, level)
 
-    # Carica configurazione
+    if args.profile and not args.replay:
+        logger.error("❌ --profile si usa insieme a --replay")
+        sys.exit(1)
+
+    # Carica configurazione (uno o più negozi)
     config = load_config(args.config)
+    if config.get('logging'):
+        setup_logging({**config['logging'], **cli_logging}, level)
+    try:
+        stores = store_configs(config)
+    except ValueError as e:
+        logger.error(f"❌ Configurazione non valida: {e}")
+        sys.exit(1)
 
     # Valida configurazione
     required_fields = [
@@ -555,19 +4056,69 @@ def main():
         'nocodb.table_ids.ordini'
     ]
 
-    for field in required_fields:
-        keys = field.split('.')
-        val = config
-        for key in keys:
-            val = val.get(key) if isinstance(val, dict) else None
+    for store in stores:
+        for field in required_fields:
+            keys = field.split('.')
+            val = store
+            for key in keys:
+                val = val.get(key) if isinstance(val, dict) else None
 
-        if not val:
-            logger.error(f"❌ Configurazione mancante: {field}")
-            sys.exit(1)
+            if not val:
+                prefix = f"{store['name']}: " if store.get('name') else ''
+                logger.error(f"❌ Configurazione mancante: {prefix}{field}")
+                sys.exit(1)
+
+        if args.no_fields_projection:
+            store['woocommerce']['fields_projection'] = False
+
+        if args.restart_full_sync:
+            store.setdefault('full_sync', {})['resume'] = False
+
+        if args.record:
+            # Con più negozi, una sottocartella per negozio (la stessa letta da --replay)
+            store['record_dir'] = (os.path.join(args.record, store_dir_name(store['name']))
+                                   if config.get('stores') else args.record)
 
     # Esegui sync
-    syncer = WCNocODBSyncer(config)
-    syncer.run(full_sync=args.full_sync)
+    if len(stores) > 1 or config.get('stores'):
+        if args.serve:
+            logger.error("❌ Il server webhook supporta un solo negozio: avvia un processo --serve per negozio")
+            sys.exit(1)
+        if args.profile:
+            logger.error("❌ --profile supporta un solo negozio: usa la config di un negozio")
+            sys.exit(1)
+        syncer = MultiStoreSyncer(config, stores)
+    else:
+        syncer = WCNocODBSyncer(config)
+
+    if args.rebuild_state:
+        syncer.rebuild_state()
+        return
+
+    if args.refresh_frozen:
+        syncer.refresh_frozen()
+        return
+
+    if args.daemon:
+        SyncDaemon(syncer, config.get('daemon') or {}).run_forever()
+        return
+
+    if args.serve:
+        webhook_config = config.get('webhook') or {}
+        if not webhook_config.get('secret'):
+            logger.error("❌ Configurazione mancante: webhook.secret")
+            sys.exit(1)
+        WebhookServer(syncer, webhook_config).serve_forever()
+        return
+
+    if args.replay:
+        if isinstance(syncer, MultiStoreSyncer):
+            syncer.run(replay=args.replay)
+        else:
+            syncer.run(replay=args.replay, profile=args.profile)
+        return
+
+    syncer.run(full_sync=args.full_sync, reconcile=args.reconcile)
 
 
 if __name__ == '__main__':